@@ -8,7 +8,7 @@ from basics.base_pe import BasePE
 from modules.fastspeech.param_adaptor import VARIANCE_CHECKLIST
 from modules.fastspeech.tts_modules import LengthRegulator
 from modules.vocoders.registry import VOCODERS
-from utils.binarizer_utils import get_mel2ph_torch
+from utils.binarizer_utils import get_mel2ph_torch, load_wav_cached
 from utils.hparams import hparams
 from utils.infer_utils import resample_align_curve
 
@@ -21,19 +21,20 @@ class SpectrogramStretchAugmentation(BaseAugmentation):
     def __init__(self, data_dirs: list, augmentation_args: dict, pe: BasePE = None):
         super().__init__(data_dirs, augmentation_args)
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self.lr = LengthRegulator().to(self.device)
+        self.lr = LengthRegulator(mode='search').to(self.device)
         self.pe = pe
 
     @require_same_keys
     def process_item(self, item: dict, key_shift=0., speed=1., replace_spk_id=None) -> dict:
         aug_item = deepcopy(item)
+        waveform = load_wav_cached(aug_item['wav_fn'], hparams['audio_sample_rate'])
         if hparams['vocoder'] in VOCODERS:
             wav, mel = VOCODERS[hparams['vocoder']].wav2spec(
-                aug_item['wav_fn'], keyshift=key_shift, speed=speed
+                waveform, keyshift=key_shift, speed=speed
             )
         else:
             wav, mel = VOCODERS[hparams['vocoder'].split('.')[-1]].wav2spec(
-                aug_item['wav_fn'], keyshift=key_shift, speed=speed
+                waveform, keyshift=key_shift, speed=speed
             )
 
         aug_item['mel'] = mel
@@ -47,6 +48,7 @@ class SpectrogramStretchAugmentation(BaseAugmentation):
                 self.lr, torch.from_numpy(aug_item['ph_dur']), aug_item['length'], self.timestep, device=self.device
             ).cpu().numpy()
 
+            assert self.pe is not None, 'The pitch extractor of time stretching augmentation is not set.'
             f0, _ = self.pe.get_pitch(
                 wav, aug_item['length'], hparams, speed=speed, interp_uv=hparams['interp_uv']
             )
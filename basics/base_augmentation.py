@@ -1,3 +1,5 @@
+import functools
+
 from utils.hparams import hparams
 
 
@@ -18,6 +20,7 @@ class BaseAugmentation:
 
 
 def require_same_keys(func):
+    @functools.wraps(func)
     def run(*args, **kwargs):
         item: dict = args[1]
         res: dict = func(*args, **kwargs)
@@ -1,16 +1,20 @@
+import bisect
+import hashlib
 import json
+import os
 import pathlib
 import random
 import shutil
 import warnings
-from copy import deepcopy
+from collections import Counter
 
 import numpy as np
 import torch
 from tqdm import tqdm
 
+from utils.binarizer_utils import BinarizationJournal, FeatureCache
 from utils.hparams import hparams
-from utils.indexed_datasets import IndexedDatasetBuilder
+from utils.indexed_datasets import IndexedDataset, IndexedDatasetBuilder, replace_indexed_dataset
 from utils.multiprocess_utils import chunked_multiprocess_run
 from utils.phoneme_utils import build_phoneme_list, locate_dictionary
 from utils.plot import distribution_to_figure
@@ -41,6 +45,11 @@ class BaseBinarizer:
             how to split the dataset;
         3. load_ph_set:
             the phoneme set.
+
+        Incremental binarization:
+            each run writes a manifest of item signatures (see *item_signature* and *preprocessing_hparams*)
+            beside the binary data. When binarization_args.incremental is enabled, unchanged items are
+            restored from the previous binary data (see *restore_item*) instead of being processed again.
     """
 
     def __init__(self, data_dir=None, data_attrs=None):
@@ -64,12 +73,25 @@ class BaseBinarizer:
 
         self.items = {}
         self.item_names: list = None
+        # (index, count) if only one shard of the items is processed
+        self.shard: tuple = None
         self._train_item_names: list = None
         self._valid_item_names: list = None
 
         self.phone_encoder = TokenTextEncoder(vocab_list=build_phoneme_list())
         self.timestep = hparams['hop_size'] / hparams['audio_sample_rate']
 
+        # hparams that affect the extracted features; changing any of them invalidates the manifest
+        self.preprocessing_hparams = [
+            'audio_sample_rate', 'hop_size', 'win_size', 'fft_size', 'fmin', 'fmax',
+            'pe', 'pe_ckpt', 'pe_chunk_length', 'pe_chunk_overlap'
+        ]
+        self.previous_dataset: IndexedDataset = None
+        # features of the current batch computed by prepare_batch
+        self.prepared = {}
+        feature_cache_dir = self.binarization_args.get('feature_cache_dir')
+        self.feature_cache = FeatureCache(feature_cache_dir) if feature_cache_dir else None
+
     def build_spk_map(self):
         assert isinstance(self.speakers, list), 'Speakers must be a list'
         assert len(self.speakers) == len(self.raw_data_dirs), \
@@ -92,8 +114,40 @@ class BaseBinarizer:
         print("| spk_map: ", self.spk_map)
 
     def load_meta_data(self, raw_data_dir: pathlib.Path, ds_id, spk_id):
+        """
+        Load meta data of all items in one raw dataset.
+        :return: a dict mapping item names ('<ds_id>:<name>') to their meta data
+        """
         raise NotImplementedError()
 
+    def load_all_meta_data(self, num_workers=0):
+        """
+        Load meta data of all raw datasets into self.items, in parallel if num_workers > 0.
+        """
+        args = [
+            (pathlib.Path(data_dir), ds_id, spk_id)
+            for ds_id, (spk_id, data_dir) in enumerate(zip(self.spk_ids, self.raw_data_dirs))
+        ]
+        if num_workers > 0 and len(args) > 1:
+            results = chunked_multiprocess_run(self.load_meta_data, args, num_workers=num_workers)
+        else:
+            results = (self.load_meta_data(*a) for a in args)
+        for a, meta_data_dict in zip(args, results):
+            if meta_data_dict is None:
+                raise BinarizationError(f'Failed to load meta data from \'{a[0]}\'.')
+            self.items.update(meta_data_dict)
+
+    @staticmethod
+    def _match_prefix(sorted_keys, prefix):
+        """
+        Range of the keys starting with prefix in a sorted list.
+        """
+        start = bisect.bisect_left(sorted_keys, prefix)
+        end = start
+        while end < len(sorted_keys) and sorted_keys[end].startswith(prefix):
+            end += 1
+        return start, end
+
     def split_train_valid_set(self):
         """
         Split the dataset into training set and validation set.
@@ -101,36 +155,32 @@ class BaseBinarizer:
         """
         prefixes = set([str(pr) for pr in hparams['test_prefixes']])
         valid_item_names = set()
+        # Indexes of item names with and without speaker id, sorted for prefix matching
+        full_names = sorted(self.item_names)
+        short_names = sorted((name.split(':')[-1], name) for name in self.item_names)
+        short_keys = [short for short, _ in short_names]
         # Add prefixes that specified speaker index and matches exactly item name to test set
-        for prefix in deepcopy(prefixes):
-            if prefix in self.item_names:
+        for prefix in sorted(prefixes):
+            if prefix in self.items:
                 valid_item_names.add(prefix)
                 prefixes.remove(prefix)
         # Add prefixes that exactly matches item name without speaker id to test set
-        for prefix in deepcopy(prefixes):
-            matched = False
-            for name in self.item_names:
-                if name.split(':')[-1] == prefix:
-                    valid_item_names.add(name)
-                    matched = True
-            if matched:
+        for prefix in sorted(prefixes):
+            start = bisect.bisect_left(short_keys, prefix)
+            end = bisect.bisect_right(short_keys, prefix)
+            if end > start:
+                valid_item_names.update(name for _, name in short_names[start: end])
                 prefixes.remove(prefix)
         # Add names with one of the remaining prefixes to test set
-        for prefix in deepcopy(prefixes):
-            matched = False
-            for name in self.item_names:
-                if name.startswith(prefix):
-                    valid_item_names.add(name)
-                    matched = True
-            if matched:
+        for prefix in sorted(prefixes):
+            start, end = self._match_prefix(full_names, prefix)
+            if end > start:
+                valid_item_names.update(full_names[start: end])
                 prefixes.remove(prefix)
-        for prefix in deepcopy(prefixes):
-            matched = False
-            for name in self.item_names:
-                if name.split(':')[-1].startswith(prefix):
-                    valid_item_names.add(name)
-                    matched = True
-            if matched:
+        for prefix in sorted(prefixes):
+            start, end = self._match_prefix(short_keys, prefix)
+            if end > start:
+                valid_item_names.update(name for _, name in short_names[start: end])
                 prefixes.remove(prefix)
 
         if len(prefixes) != 0:
@@ -142,7 +192,8 @@ class BaseBinarizer:
 
         valid_item_names = sorted(list(valid_item_names))
         assert len(valid_item_names) > 0, 'Validation set is empty!'
-        train_item_names = [x for x in self.item_names if x not in set(valid_item_names)]
+        valid_item_set = set(valid_item_names)
+        train_item_names = [x for x in self.item_names if x not in valid_item_set]
         assert len(train_item_names) > 0, 'Training set is empty!'
 
         return train_item_names, valid_item_names
@@ -164,10 +215,38 @@ class BaseBinarizer:
             meta_data = self.items[item_name]
             yield item_name, meta_data
 
-    def process(self):
+    def shard_prefix(self, prefix, shard=None):
+        """
+        File name prefix of a (shard of) dataset split.
+        """
+        shard = self.shard if shard is None else shard
+        if shard is None:
+            return prefix
+        return f'{prefix}.shard-{shard[0]}-of-{shard[1]}'
+
+    def in_shard(self, item_name):
+        """
+        Whether an item belongs to the current shard. Items are assigned by a hash of their names,
+        so the partition does not depend on the machine, the item order or the other items.
+        """
+        if self.shard is None:
+            return True
+        index, count = self.shard
+        return int(hashlib.sha1(item_name.encode('utf-8')).hexdigest(), 16) % count == index
+
+    def process(self, shard=None):
+        """
+        :param shard: (index, count) to process only one of count disjoint shards of the items,
+                      writing <prefix>.shard-<index>-of-<count>.* files instead of the final binary data.
+                      Shards can be processed independently and then combined by merge_shards(count).
+        """
+        if shard is not None:
+            index, count = shard
+            if not 0 <= index < count:
+                raise ValueError(f'Invalid shard index {index} for {count} shards.')
+            self.shard = (index, count)
         # load each dataset
-        for ds_id, spk_id, data_dir in zip(range(len(self.raw_data_dirs)), self.spk_ids, self.raw_data_dirs):
-            self.load_meta_data(pathlib.Path(data_dir), ds_id=ds_id, spk_id=spk_id)
+        self.load_all_meta_data(num_workers=int(self.binarization_args['num_workers']))
         self.item_names = sorted(list(self.items.keys()))
         self._train_item_names, self._valid_item_names = self.split_train_valid_set()
 
@@ -198,21 +277,15 @@ class BaseBinarizer:
     def check_coverage(self):
         # Group by phonemes in the dictionary.
         ph_required = set(build_phoneme_list())
-        phoneme_map = {}
-        for ph in ph_required:
-            phoneme_map[ph] = 0
-        ph_occurred = []
 
         # Load and count those phones that appear in the actual data
-        for item_name in self.items:
-            ph_occurred += self.items[item_name]['ph_seq']
-            if len(ph_occurred) == 0:
+        ph_counts = Counter()
+        for item_name, meta_data in self.items.items():
+            if len(meta_data['ph_seq']) == 0:
                 raise BinarizationError(f'Empty tokens in {item_name}.')
-        for ph in ph_occurred:
-            if ph not in ph_required:
-                continue
-            phoneme_map[ph] += 1
-        ph_occurred = set(ph_occurred)
+            ph_counts.update(meta_data['ph_seq'])
+        phoneme_map = {ph: ph_counts[ph] for ph in ph_required}
+        ph_occurred = set(ph_counts.keys())
 
         print('===== Phoneme Distribution Summary =====')
         for i, key in enumerate(sorted(phoneme_map.keys())):
@@ -246,61 +319,365 @@ class BaseBinarizer:
                                     f' (+) {sorted(unrecognizable_phones)}\n'
                                     f' (-) {sorted(missing_phones)}')
 
+    def preprocessing_signature(self):
+        signature = {
+            'attrs': self.data_attrs,
+            'phonemes': self.phone_encoder.vocab_list,
+            'hparams': {k: hparams.get(k) for k in self.preprocessing_hparams},
+            'augmentation': self.augmentation_args
+        }
+        return hashlib.sha1(json.dumps(signature, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def item_dependencies(self, item_name, meta_data):
+        """
+        Files whose contents the features of an item are extracted from.
+        """
+        return [meta_data['wav_fn']]
+
+    def item_signature(self, item_name, meta_data):
+        """
+        Signature of the inputs of one item. The features of an item are reused in incremental
+        binarization only if its signature does not change. Files are tracked by size and mtime.
+        """
+        signature = hashlib.sha1(json.dumps(meta_data, sort_keys=True).encode('utf-8'))
+        for fn in self.item_dependencies(item_name, meta_data):
+            try:
+                stat = os.stat(fn)
+                signature.update(f'{fn}:{stat.st_size}:{stat.st_mtime_ns}'.encode('utf-8'))
+            except FileNotFoundError:
+                signature.update(f'{fn}:missing'.encode('utf-8'))
+        return signature.hexdigest()
+
+    def load_manifest(self, prefix):
+        manifest_fn = self.binary_data_dir / f'{prefix}.manifest.json'
+        if not manifest_fn.exists() or not (self.binary_data_dir / f'{prefix}.data').exists():
+            return {}
+        with open(manifest_fn, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('signature') != self.preprocessing_signature():
+            print(f'| {prefix}: preprocessing configuration changed, all items will be processed again.')
+            return {}
+        return manifest['items']
+
+    def initialize_worker(self):
+        """
+        Called once in each worker process before processing any items.
+        Subclasses can initialize their models (e.g. pitch extractors) here.
+        """
+        pass
+
+    def dataset_metadata(self):
+        """
+        :return: dataset-level information saved in the binary data, which can be read by training datasets
+        """
+        return {}
+
     def process_dataset(self, prefix, num_workers=0, apply_augmentation=False):
         args = []
-        builder = IndexedDatasetBuilder(self.binary_data_dir, prefix=prefix, allowed_attr=self.data_attrs)
+        output_prefix = self.shard_prefix(prefix)
+        metadata = self.dataset_metadata()
+        # Processed items are written into parts recorded by a journal, so that an interrupted run
+        # can be resumed. The previous data can still be read when reusing items, and it will not be
+        # destroyed if this run is interrupted.
+        journal = BinarizationJournal(
+            self.binary_data_dir, output_prefix, signature=self.preprocessing_signature(),
+            create_builder=lambda p: self.create_builder(p, metadata=metadata),
+            commit_interval=self.binarization_args.get('checkpoint_interval', 0)
+        )
+        resumed = journal.load()
         lengths = []
         total_sec = 0
         total_raw_sec = 0
-
-        for item_name, meta_data in self.meta_data_iterator(prefix):
-            args.append([item_name, meta_data, self.binarization_args])
-
-        aug_map = self.arrange_data_augmentation(self.meta_data_iterator(prefix)) if apply_augmentation else {}
-
-        def postprocess(_item):
-            nonlocal total_sec, total_raw_sec
-            if _item is None:
-                return
-            builder.add_item(_item)
-            lengths.append(_item['length'])
-            total_sec += _item['seconds']
-            total_raw_sec += _item['seconds']
-
-            for task in aug_map.get(_item['name'], []):
-                aug_item = task['func'](_item, **task['kwargs'])
-                builder.add_item(aug_item)
-                lengths.append(aug_item['length'])
-                total_sec += aug_item['seconds']
+        num_reused = 0
+        num_reused_aug = 0
+        num_resumed = 0
+
+        previous_manifest = self.load_manifest(output_prefix) \
+            if self.binarization_args.get('incremental', False) else {}
+        if len(previous_manifest) > 0:
+            self.previous_dataset = IndexedDataset(self.binary_data_dir, output_prefix)
+        manifest = {}
+
+        signatures = {}
+        aug_map = {}
+        if apply_augmentation:
+            # Unchanged items keep the augmentation arranged by the previous run, so that their augmented
+            # items can be reused. Augmentation of the other items is arranged over all of them (not only
+            # the ones in this shard), so that each shard gets the same arrangement.
+            kept = {}
+            for item_name, meta_data in self.meta_data_iterator(prefix):
+                reuse = previous_manifest.get(item_name)
+                if reuse is None or reuse['index'] is None:
+                    continue
+                signatures[item_name] = self.item_signature(item_name, meta_data)
+                if reuse['signature'] == signatures[item_name]:
+                    kept[item_name] = reuse.get('augmentation', [])
+            if len(kept) > 0:
+                aug_map.update(self.restore_data_augmentation(kept))
+            aug_map.update(self.arrange_data_augmentation(
+                (item_name, meta_data) for item_name, meta_data in self.meta_data_iterator(prefix)
+                if item_name not in kept
+            ))
+
+        for order, (item_name, meta_data) in enumerate(self.meta_data_iterator(prefix)):
+            if not self.in_shard(item_name):
+                continue
+            signature = signatures.get(item_name) or self.item_signature(item_name, meta_data)
+            manifest[item_name] = {'signature': signature}
+            if self.shard is not None:
+                # position of the item in the merged dataset
+                manifest[item_name]['order'] = order
+            aug_tasks = aug_map.get(item_name, [])
+            # arguments of the augmented items (normalized as they are stored in the manifest)
+            augmentation = json.loads(json.dumps([task['kwargs'] for task in aug_tasks]))
+            if len(augmentation) > 0:
+                manifest[item_name]['augmentation'] = augmentation
+            if item_name in resumed and resumed[item_name]['signature'] == signature:
+                num_resumed += 1
+                continue
+            reuse = previous_manifest.get(item_name)
+            if reuse is not None and reuse['signature'] != signature:
+                reuse = None
+            if reuse is not None:
+                num_reused += 1
+                # augmented items with the same arguments are also restored instead of being computed again
+                restore_augmented = len(augmentation) > 0 and reuse.get('augmentation') == augmentation \
+                    and len(reuse.get('aug_lengths', [])) == len(augmentation)
+                reuse = {**reuse, 'restore_augmented': restore_augmented}
+                if restore_augmented:
+                    num_reused_aug += 1
+            args.append([item_name, meta_data, self.binarization_args, aug_tasks, reuse])
+        if num_resumed > 0:
+            print(f'| {output_prefix}: resuming, {num_resumed} items were processed by the interrupted run.')
+        elif len(resumed) > 0:
+            journal.clear()
+        if len(previous_manifest) > 0:
+            print(
+                f'| {output_prefix}: {num_reused} items are unchanged and will be reused '
+                f'({num_reused_aug} of them together with their augmented items).'
+            )
 
         try:
+            batch_size = self.binarization_args.get('batch_size', 1)
+            batches = [args[i: i + batch_size] for i in range(0, len(args), batch_size)]
             if num_workers > 0:
                 # code for parallel processing
-                for item in tqdm(
-                        chunked_multiprocess_run(self.process_item, args, num_workers=num_workers),
-                        total=len(list(self.meta_data_iterator(prefix)))
-                ):
-                    postprocess(item)
+                results = chunked_multiprocess_run(
+                    self.process_batch_with_augmentation, [(b,) for b in batches],
+                    num_workers=num_workers, init_func=self.initialize_worker
+                )
             else:
                 # code for single cpu processing
-                for a in tqdm(args):
-                    item = self.process_item(*a)
-                    postprocess(item)
-        except KeyboardInterrupt:
-            builder.finalize()
-            raise
+                results = (self.process_batch_with_augmentation(b) for b in batches)
+            with tqdm(total=len(args)) as pbar:
+                for batch, batch_items in zip(batches, results):
+                    if batch_items is None:
+                        # the whole batch failed in the worker process
+                        batch_items = [None] * len(batch)
+                    for a, items in zip(batch, batch_items):
+                        if items is not None:
+                            journal.add(a[0], manifest[a[0]]['signature'], items)
+                    pbar.update(len(batch))
+        finally:
+            # Keep the processed items even if this run is interrupted.
+            journal.commit()
+            self.previous_dataset = None
+        print(f'| {output_prefix} writer: {journal.report()}')
+
+        # Collect the items in order. The first item is the original one, followed by its augmented items.
+        for item_name, item_manifest in manifest.items():
+            entry = journal.entries.get(item_name)
+            if entry is None or entry['signature'] != item_manifest['signature']:
+                item_manifest['index'] = None
+                continue
+            item_manifest.update({
+                'index': len(lengths),
+                'count': len(entry['lengths']),
+                'length': entry['lengths'][0],
+                'seconds': entry['seconds'][0]
+            })
+            if len(entry['lengths']) > 1:
+                item_manifest['aug_lengths'] = entry['lengths'][1:]
+                item_manifest['aug_seconds'] = entry['seconds'][1:]
+            lengths.extend(entry['lengths'])
+            total_sec += sum(entry['seconds'])
+            total_raw_sec += entry['seconds'][0]
+        if num_resumed == 0 and journal.num_parts == 1:
+            # all items are written into one part in order
+            data_path = journal.part_path(0)
+        else:
+            builder = self.create_builder(f'{output_prefix}.tmp', metadata=metadata)
+            builder.open()
+            try:
+                for item_name, item_manifest in tqdm(manifest.items(), desc=f'Collecting {output_prefix}'):
+                    if item_manifest['index'] is not None:
+                        for item in journal.read_items(journal.entries[item_name]):
+                            builder.add_item(item)
+            finally:
+                builder.finalize()
+            data_path = builder.path
+        self.save_dataset(output_prefix, data_path, lengths, manifest)
+        journal.clear()
+
+        if apply_augmentation and total_raw_sec > 0:
+            print(f'| {prefix} total duration (before augmentation): {total_raw_sec:.2f}s')
+            print(
+                f'| {prefix} total duration (after augmentation): {total_sec:.2f}s ({total_sec / total_raw_sec:.2f}x)')
+        else:
+            print(f'| {prefix} total duration: {total_raw_sec:.2f}s')
 
-        builder.finalize()
+    def create_builder(self, prefix, metadata):
+        return IndexedDatasetBuilder(
+            self.binary_data_dir, prefix=prefix, allowed_attr=self.data_attrs,
+            backend=self.binarization_args.get('dataset_format', 'hdf5'), metadata=metadata,
+            compression=self.binarization_args.get('compression'),
+            queue_size=self.binarization_args.get('writer_queue_size', 0)
+        )
+
+    def save_dataset(self, prefix, data_path, lengths, manifest):
+        """
+        Move the finalized data to <prefix>.data and save the lengths and the manifest.
+        """
+        replace_indexed_dataset(data_path, self.binary_data_dir / f'{prefix}.data')
         with open(self.binary_data_dir / f'{prefix}.lengths', 'wb') as f:
             # noinspection PyTypeChecker
             np.save(f, lengths)
+        manifest = {'signature': self.preprocessing_signature(), 'items': manifest}
+        if self.shard is not None:
+            manifest['shard'] = list(self.shard)
+        with open(self.binary_data_dir / f'{prefix}.manifest.json', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
 
-        if apply_augmentation:
-            print(f'| {prefix} total duration (before augmentation): {total_raw_sec:.2f}s')
-            print(
-                f'| {prefix} total duration (after augmentation): {total_sec:.2f}s ({total_sec / total_raw_sec:.2f}x)')
+    def merge_shards(self, num_shards):
+        """
+        Merge the shards written by process(shard=(i, num_shards)) for all i into the final binary data.
+        Items are placed in the same order as if the whole dataset were processed at once, and the
+        merged manifest can be used by incremental binarization. Shard files are left untouched.
+        """
+        self.shard = None
+        for prefix in ['valid', 'train']:
+            self.merge_dataset_shards(prefix, num_shards)
+
+    def merge_dataset_shards(self, prefix, num_shards):
+        signature = self.preprocessing_signature()
+        shards = []
+        shard_lengths = []
+        entries = []
+        for i in range(num_shards):
+            shard_prefix = self.shard_prefix(prefix, shard=(i, num_shards))
+            manifest_fn = self.binary_data_dir / f'{shard_prefix}.manifest.json'
+            if not manifest_fn.exists():
+                raise BinarizationError(f'Shard {i} of {num_shards} is missing: {manifest_fn}')
+            with open(manifest_fn, 'r', encoding='utf-8') as f:
+                shard_manifest = json.load(f)
+            if shard_manifest.get('signature') != signature:
+                raise BinarizationError(
+                    f'Shard {i} of {num_shards} ({manifest_fn}) was binarized with a different '
+                    f'preprocessing configuration.'
+                )
+            dataset = IndexedDataset(self.binary_data_dir, shard_prefix)
+            dataset.open()
+            shards.append(dataset)
+            shard_lengths.append(np.load(self.binary_data_dir / f'{shard_prefix}.lengths'))
+            entries.extend(
+                (entry['order'], i, item_name, entry)
+                for item_name, entry in shard_manifest['items'].items()
+            )
+        entries.sort(key=lambda e: e[0])
+
+        builder = self.create_builder(f'{prefix}.tmp', metadata=shards[0].metadata)
+        builder.open()
+        lengths = []
+        manifest = {}
+        try:
+            for _, i, item_name, entry in tqdm(entries, desc=f'Merging {prefix}'):
+                entry = {k: v for k, v in entry.items() if k != 'order'}
+                if entry['index'] is not None:
+                    start = entry['index']
+                    entry['index'] = len(lengths)
+                    for j in range(start, start + entry['count']):
+                        builder.add_item(shards[i].read_item(j))
+                        lengths.append(shard_lengths[i][j])
+                manifest[item_name] = entry
+        finally:
+            builder.finalize()
+            for dataset in shards:
+                dataset.dset.close()
+                dataset.dset = None
+        print(f'| {prefix}: merged {len(entries)} items from {num_shards} shards; writer: {builder.report()}')
+        self.save_dataset(prefix, builder.path, lengths, manifest)
+
+    def restore_item(self, item_name, meta_data, reuse):
+        """
+        Rebuild a processed item from the attributes stored in the previous binary data.
+        Subclasses should add the attributes that are not stored but required by augmentation.
+        """
+        stored = self.previous_dataset[reuse['index']]
+        item = {
+            'name': item_name,
+            'wav_fn': meta_data['wav_fn'],
+            'seconds': reuse['seconds'],
+            'length': reuse['length']
+        }
+        for k, v in stored.items():
+            item[k] = v.numpy() if isinstance(v, torch.Tensor) else v
+        return item
+
+    def restore_augmented_items(self, item_name, reuse):
+        """
+        Read the augmented items of a reused item from the previous binary data. They are written
+        as they are, so only the stored attributes are restored.
+        """
+        items = []
+        for i, (length, seconds) in enumerate(zip(reuse['aug_lengths'], reuse['aug_seconds']), start=1):
+            stored = self.previous_dataset[reuse['index'] + i]
+            item = {
+                'name': item_name,
+                'seconds': seconds,
+                'length': length
+            }
+            for k, v in stored.items():
+                item[k] = v.numpy() if isinstance(v, torch.Tensor) else v
+            items.append(item)
+        return items
+
+    def prepare_batch(self, batch_args):
+        """
+        Compute features of a batch of items together before they are processed one by one, e.g. to
+        run batched inference of pitch extractors. Results should be put into self.prepared[item_name]
+        and used by process_item. Items to restore (with reuse not being None) can be ignored.
+        :param batch_args: list of arguments of process_item_with_augmentation
+        """
+        pass
+
+    def process_batch_with_augmentation(self, batch_args):
+        """
+        Process a batch of items (see binarization_args.batch_size) in the same (worker) process.
+        :return: a list of results of process_item_with_augmentation
+        """
+        try:
+            if len(batch_args) > 1:
+                self.prepare_batch(batch_args)
+            return [self.process_item_with_augmentation(*a) for a in batch_args]
+        finally:
+            self.prepared.clear()
+
+    def process_item_with_augmentation(self, item_name, meta_data, binarization_args, aug_tasks, reuse=None):
+        """
+        Process (or restore) one piece of data and apply its augmentation tasks in the same (worker) process.
+        :return: [item, *augmented_items], or None if the item is skipped
+        """
+        if reuse is None:
+            item = self.process_item(item_name, meta_data, binarization_args)
+        elif reuse['index'] is None:
+            item = None
         else:
-            print(f'| {prefix} total duration: {total_raw_sec:.2f}s')
+            item = self.restore_item(item_name, meta_data, reuse)
+        if item is None:
+            return None
+        if reuse is not None and reuse.get('restore_augmented', False):
+            return [item] + self.restore_augmented_items(item_name, reuse)
+        return [item] + [task['func'](item, **task['kwargs']) for task in aug_tasks]
 
     def arrange_data_augmentation(self, data_iterator):
         """
@@ -308,5 +685,13 @@ class BaseBinarizer:
         """
         raise NotImplementedError()
 
+    def restore_data_augmentation(self, aug_args_map):
+        """
+        Rebuild the augmentation tasks of items from their arguments recorded in the manifest
+        (see arrange_data_augmentation for the format of the results).
+        :param aug_args_map: {item_name: [kwargs of each augmentation task of the item]}
+        """
+        raise NotImplementedError()
+
     def process_item(self, item_name, meta_data, binarization_args):
         raise NotImplementedError()
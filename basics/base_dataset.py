@@ -1,6 +1,7 @@
 import os
 
 import numpy as np
+import torch
 from torch.utils.data import Dataset
 
 from utils.hparams import hparams
@@ -27,14 +28,23 @@ class BaseDataset(Dataset):
         self.prefix = prefix
         self.data_dir = hparams['binary_data_dir']
         self.sizes = np.load(os.path.join(self.data_dir, f'{self.prefix}.lengths'))
-        self.indexed_ds = IndexedDataset(self.data_dir, self.prefix)
+        self.indexed_ds = IndexedDataset(
+            self.data_dir, self.prefix, cache_bytes=int(hparams.get('dataset_cache_size', 0) * 1024 ** 2)
+        )
+        if hparams.get('dataset_preload', False):
+            # loaded once in this process and shared with all dataloader workers
+            self.indexed_ds.preload()
+            self.indexed_ds.cache_bytes = 0
 
     @property
     def _sizes(self):
         return self.sizes
 
     def __getitem__(self, index):
-        return self.indexed_ds[index]
+        return {
+            'index': index,
+            **self.indexed_ds[index]
+        }
 
     def __len__(self):
         return len(self._sizes)
@@ -49,5 +59,6 @@ class BaseDataset(Dataset):
 
     def collater(self, samples):
         return {
-            'size': len(samples)
+            'size': len(samples),
+            'indices': torch.LongTensor([s['index'] for s in samples])
         }
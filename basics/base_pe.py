@@ -1,3 +1,13 @@
 class BasePE:
     def get_pitch(self, waveform, length, hparams, interp_uv=False, speed=1):
         raise NotImplementedError()
+
+    def get_pitch_batch(self, waveforms, lengths, hparams, interp_uv=False, speed=1):
+        """
+        Extract pitch from a batch of waveforms. Returns a list of (f0, uv) tuples.
+        Extractors that support batched inference should override this method.
+        """
+        return [
+            self.get_pitch(waveform, length, hparams, interp_uv=interp_uv, speed=speed)
+            for waveform, length in zip(waveforms, lengths)
+        ]
@@ -73,6 +73,7 @@ class BaseTask(pl.LightningModule):
             hparams['max_val_batch_size'] = self.max_val_batch_size = self.max_batch_size
 
         self.training_sampler = None
+        self.validation_sampler = None
         self.model = None
         self.skip_immediate_validation = False
         self.skip_immediate_ckpt_save = False
@@ -207,6 +208,10 @@ class BaseTask(pl.LightningModule):
     def on_train_epoch_start(self):
         if self.training_sampler is not None:
             self.training_sampler.set_epoch(self.current_epoch)
+            # compute wasted on padded frames, as seen by this rank
+            self.logger.log_metrics(
+                {'training/padding_ratio': self.training_sampler.padding_ratio}, step=self.global_step
+            )
 
     def _training_step(self, sample):
         """
@@ -262,6 +267,10 @@ class BaseTask(pl.LightningModule):
             return {}
         with torch.autocast(self.device.type, enabled=False):
             losses, weight = self._validation_step(sample, batch_idx)
+        if not self.validation_sampler.weighted[batch_idx]:
+            # Filler batches, and batches iterated on rank 0 only for plotting, do not count in the losses.
+            # The metrics are still updated (with zero weight) so that all ranks have the same metrics to sync.
+            weight = 0
         losses = {
             'total_loss': sum(losses.values()),
             **losses
@@ -282,7 +291,8 @@ class BaseTask(pl.LightningModule):
         self.logger.log_metrics({f'validation/{k}': v for k, v in loss_vals.items()}, step=self.global_step)
         for metric in self.valid_losses.values():
             metric.reset()
-        metric_vals = {k: getattr(self, k).compute() for k in self.valid_metric_names}
+        # compute() synchronizes the metric across ranks, so all ranks must call it in the same order
+        metric_vals = {k: getattr(self, k).compute() for k in sorted(self.valid_metric_names)}
         self.logger.log_metrics({f'metrics/{k}': v for k, v in metric_vals.items()}, step=self.global_step)
         for metric_name in self.valid_metric_names:
             getattr(self, metric_name).reset()
@@ -334,6 +344,7 @@ class BaseTask(pl.LightningModule):
             num_replicas=(self.trainer.distributed_sampler_kwargs or {}).get('num_replicas', 1),
             rank=(self.trainer.distributed_sampler_kwargs or {}).get('rank', 0),
             sort_by_similar_size=hparams['sort_by_len'],
+            bucketing=hparams.get('sampler_bucketing', 'greedy'),
             required_batch_count_multiple=hparams['accumulate_grad_batches'],
             shuffle_sample=True,
             shuffle_batch=False,
@@ -348,18 +359,23 @@ class BaseTask(pl.LightningModule):
                                            persistent_workers=True)
 
     def val_dataloader(self):
-        sampler = DsEvalBatchSampler(
+        self.validation_sampler = DsEvalBatchSampler(
             self.valid_dataset,
             max_batch_frames=self.max_val_batch_frames,
             max_batch_size=self.max_val_batch_size,
+            num_replicas=(self.trainer.distributed_sampler_kwargs or {}).get('num_replicas', 1),
             rank=(self.trainer.distributed_sampler_kwargs or {}).get('rank', 0),
-            batch_by_size=False
+            batch_by_size=True,
+            num_leading_items=hparams['num_valid_plots']
         )
         return torch.utils.data.DataLoader(self.valid_dataset,
                                            collate_fn=self.valid_dataset.collater,
-                                           batch_sampler=sampler,
+                                           batch_sampler=self.validation_sampler,
                                            num_workers=hparams['ds_workers'],
                                            prefetch_factor=hparams['dataloader_prefetch_factor'],
+                                           # keep the workers (and their item caches) alive across validations
+                                           persistent_workers=hparams['ds_workers'] > 0 and
+                                                              hparams.get('dataset_cache_size', 0) > 0,
                                            shuffle=False)
 
     def test_dataloader(self):
@@ -26,7 +26,17 @@ class BaseVocoder:
     def wav2spec(wav_fn):
         """
 
-        :param wav_fn: str
+        :param wav_fn: str, or a waveform already loaded at audio_sample_rate: np.ndarray[T]
         :return: wav, mel: [T, 80]
         """
         raise NotImplementedError()
+
+    @classmethod
+    def wav2spec_batch(cls, wav_fns, keyshift=0, speed=1):
+        """
+        Extract mel spectrograms of a batch of waveforms. Subclasses can override this to run them in one pass.
+
+        :param wav_fns: list of str, or of waveforms already loaded at audio_sample_rate: np.ndarray[T]
+        :return: list of (wav, mel: [T, 80])
+        """
+        return [cls.wav2spec(wav_fn, keyshift=keyshift, speed=speed) for wav_fn in wav_fns]
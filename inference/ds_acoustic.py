@@ -40,7 +40,7 @@ class DiffSingerAcousticInfer(BaseSVSInfer):
                 assert isinstance(self.spk_map, dict) and len(self.spk_map) > 0, 'Invalid or empty speaker map!'
                 assert len(self.spk_map) == len(set(self.spk_map.values())), 'Duplicate speaker id in speaker map!'
             self.model = self.build_model(ckpt_steps=ckpt_steps)
-            self.lr = LengthRegulator().to(self.device)
+            self.lr = LengthRegulator(mode='search').to(self.device)
         if load_vocoder:
             self.vocoder = self.build_vocoder()
 
@@ -41,7 +41,7 @@ class DiffSingerVarianceInfer(BaseSVSInfer):
             assert isinstance(self.spk_map, dict) and len(self.spk_map) > 0, 'Invalid or empty speaker map!'
             assert len(self.spk_map) == len(set(self.spk_map.values())), 'Duplicate speaker id in speaker map!'
         self.model: DiffSingerVariance = self.build_model(ckpt_steps=ckpt_steps)
-        self.lr = LengthRegulator()
+        self.lr = LengthRegulator(mode='search')
         self.rr = RhythmRegulator()
         smooth_kernel_size = round(hparams['midi_smooth_width'] / self.timestep)
         self.smooth = nn.Conv1d(
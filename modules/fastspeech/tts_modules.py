@@ -288,7 +288,16 @@ class RhythmRegulator(torch.nn.Module):
 
 
 class LengthRegulator(torch.nn.Module):
-    # noinspection PyMethodMayBeStatic
+    def __init__(self, mode='mask'):
+        """
+        :param mode: 'mask' builds a [B, T_txt, T_speech] mask and is ONNX exportable;
+                     'search' looks up the token of each frame in the cumulative durations,
+                     which takes O(T_txt + T_speech) memory and is preferred outside the models.
+        """
+        super().__init__()
+        assert mode in ['mask', 'search'], f'Unknown length regulator mode: {mode}'
+        self.mode = mode
+
     def forward(self, dur, dur_padding=None, alpha=None):
         """
         Example (no batch dim version):
@@ -313,6 +322,14 @@ class LengthRegulator(torch.nn.Module):
             dur = torch.round(dur.float() * alpha).long()
         if dur_padding is not None:
             dur = dur * (1 - dur_padding.long())
+        if self.mode == 'search':
+            dur_cumsum = torch.cumsum(dur, 1)
+            total = dur_cumsum[:, -1:]
+            pos_idx = torch.arange(total.max(), device=dur.device).to(dur_cumsum.dtype)
+            pos_idx = pos_idx[None].expand(dur.shape[0], -1).contiguous()
+            # the (1-based) token index of each frame is 1 + the number of tokens ending before or at it
+            mel2ph = torch.searchsorted(dur_cumsum, pos_idx, right=True) + 1
+            return mel2ph.masked_fill(pos_idx >= total, 0)
         token_idx = torch.arange(1, dur.shape[1] + 1)[None, :, None].to(dur.device)
         dur_cumsum = torch.cumsum(dur, 1)
         dur_cumsum_prev = F.pad(dur_cumsum, [1, -1], mode='constant', value=0)
@@ -1,3 +1,4 @@
+import functools
 import os
 
 os.environ["LRU_CACHE_CAPACITY"] = "3"
@@ -46,6 +47,47 @@ class STFT:
         self.hann_window = {}
 
     def get_mel(self, y, keyshift=0, speed=1, center=False):
+        factor = 2 ** (keyshift / 12)
+        win_size_new = int(np.round(self.win_size * factor))
+        hop_length_new = int(np.round(self.hop_length * speed))
+
+        if torch.min(y) < -1.:
+            print('min value is ', torch.min(y))
+        if torch.max(y) > 1.:
+            print('max value is ', torch.max(y))
+
+        y = torch.nn.functional.pad(y.unsqueeze(1),
+                                    ((win_size_new - hop_length_new) // 2, (win_size_new - hop_length_new + 1) // 2),
+                                    mode='reflect')
+        y = y.squeeze(1)
+        return self.get_mel_from_padded(y, keyshift=keyshift, speed=speed, center=center)
+
+    def get_mel_batch(self, ys, keyshift=0, speed=1):
+        """
+        Batched version of get_mel(). Each waveform is padded on its own before they are stacked,
+        so the results are the same as calling get_mel() on each of them.
+        :param ys: list of 1-D waveforms
+        :return: list of mel spectrograms, [n_mels, T_i]
+        """
+        factor = 2 ** (keyshift / 12)
+        n_fft_new = int(np.round(self.n_fft * factor))
+        win_size_new = int(np.round(self.win_size * factor))
+        hop_length_new = int(np.round(self.hop_length * speed))
+
+        padded = [
+            torch.nn.functional.pad(
+                y[None, None],
+                ((win_size_new - hop_length_new) // 2, (win_size_new - hop_length_new + 1) // 2),
+                mode='reflect'
+            )[0, 0]
+            for y in ys
+        ]
+        n_frames = [(len(y) - n_fft_new) // hop_length_new + 1 for y in padded]
+        y = torch.nn.utils.rnn.pad_sequence(padded, batch_first=True)
+        spec = self.get_mel_from_padded(y, keyshift=keyshift, speed=speed, center=False)
+        return [spec[i, :, :n] for i, n in enumerate(n_frames)]
+
+    def get_mel_from_padded(self, y, keyshift=0, speed=1, center=False):
         sampling_rate = self.target_sr
         n_mels = self.n_mels
         n_fft = self.n_fft
@@ -60,11 +102,6 @@ class STFT:
         win_size_new = int(np.round(win_size * factor))
         hop_length_new = int(np.round(hop_length * speed))
 
-        if torch.min(y) < -1.:
-            print('min value is ', torch.min(y))
-        if torch.max(y) > 1.:
-            print('max value is ', torch.max(y))
-
         mel_basis_key = str(fmax) + '_' + str(y.device)
         if mel_basis_key not in self.mel_basis:
             mel = librosa_mel_fn(sr=sampling_rate, n_fft=n_fft, n_mels=n_mels, fmin=fmin, fmax=fmax)
@@ -74,11 +111,6 @@ class STFT:
         if keyshift_key not in self.hann_window:
             self.hann_window[keyshift_key] = torch.hann_window(win_size_new).to(y.device)
 
-        y = torch.nn.functional.pad(y.unsqueeze(1),
-                                    ((win_size_new - hop_length_new) // 2, (win_size_new - hop_length_new + 1) // 2),
-                                    mode='reflect')
-        y = y.squeeze(1)
-
         spec = torch.stft(
             y, n_fft_new, hop_length=hop_length_new,
             win_length=win_size_new, window=self.hann_window[keyshift_key],
@@ -101,3 +133,12 @@ class STFT:
         audio, sr = load_wav_to_torch(audiopath, target_sr=self.target_sr)
         spect = self.get_mel(audio.unsqueeze(0)).squeeze(0)
         return spect
+
+
+@functools.lru_cache(maxsize=None)
+def get_stft(sr, n_mels, n_fft, win_size, hop_length, fmin, fmax, clip_val=1e-5) -> STFT:
+    """
+    Get the process-wide STFT instance with the given parameters, so that its mel bases
+    and Hann windows (one for each key shift and device) are built only once.
+    """
+    return STFT(sr, n_mels, n_fft, win_size, hop_length, fmin, fmax, clip_val=clip_val)
@@ -1,15 +1,24 @@
 from utils import hparams
 
+from .cached import CachedPE
 from .pm import ParselmouthPE
 from .rmvpe import RMVPE
 
 
-def initialize_pe():
+def initialize_pe(cache=None):
     pe = hparams.get('pe', 'parselmouth')
     pe_ckpt = hparams['pe_ckpt']
     if pe == 'parselmouth':
-        return ParselmouthPE()
+        pe_ins = ParselmouthPE()
     elif pe == 'rmvpe':
-        return RMVPE(pe_ckpt)
+        chunk_length = hparams.get('pe_chunk_length')
+        chunk_overlap = hparams.get('pe_chunk_overlap', 1.)
+        pe_ins = RMVPE(pe_ckpt, chunk_length=chunk_length, chunk_overlap=chunk_overlap)
+        if chunk_length is not None:
+            # chunked inference gives slightly different results
+            pe_ckpt = f'{pe_ckpt}:chunk={chunk_length},{chunk_overlap}'
     else:
         raise ValueError(f" [x] Unknown f0 extractor: {pe}")
+    if cache is not None:
+        pe_ins = CachedPE(pe_ins, cache, version=f'{pe}:{pe_ckpt}')
+    return pe_ins
@@ -0,0 +1,55 @@
+import numpy as np
+
+from basics.base_pe import BasePE
+from utils.binarizer_utils import FeatureCache
+
+
+class CachedPE(BasePE):
+    """
+    Wrap a pitch extractor with a FeatureCache. The interpolated f0 and the uv mask are cached,
+    so results with or without interp_uv can both be derived from the same cache entry.
+    """
+
+    def __init__(self, pe: BasePE, cache: FeatureCache, version: str):
+        """
+        :param pe: the pitch extractor to wrap
+        :param cache: the feature cache
+        :param version: identifies the pitch extractor and its model, e.g. 'rmvpe:path/to/model.pt'
+        """
+        self.pe = pe
+        self.cache = cache
+        self.version = version
+
+    def _key(self, waveform, length, hparams, speed):
+        return self.cache.key(
+            waveform, length=length, speed=speed, version=self.version,
+            sample_rate=hparams['audio_sample_rate'], hop_size=hparams['hop_size']
+        )
+
+    @staticmethod
+    def _unpack(value, interp_uv):
+        f0, uv = value[0].copy(), value[1] > 0.5
+        if not interp_uv:
+            f0[uv] = 0
+        return f0, uv
+
+    def get_pitch(self, waveform, length, hparams, interp_uv=False, speed=1):
+        value = self.cache.fetch(
+            'pitch', self._key(waveform, length, hparams, speed),
+            lambda: np.stack(self.pe.get_pitch(waveform, length, hparams, interp_uv=True, speed=speed))
+        )
+        return self._unpack(value, interp_uv)
+
+    def get_pitch_batch(self, waveforms, lengths, hparams, interp_uv=False, speed=1):
+        keys = [self._key(waveform, length, hparams, speed) for waveform, length in zip(waveforms, lengths)]
+        values = [self.cache.load('pitch', key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if len(missing) > 0:
+            pitches = self.pe.get_pitch_batch(
+                [waveforms[i] for i in missing], [lengths[i] for i in missing],
+                hparams, interp_uv=True, speed=speed
+            )
+            for i, pitch in zip(missing, pitches):
+                values[i] = np.stack(pitch)
+                self.cache.save('pitch', keys[i], values[i])
+        return [self._unpack(value, interp_uv) for value in values]
@@ -7,3 +7,4 @@ MEL_FMIN = 30
 MEL_FMAX = 8000
 WINDOW_LENGTH = 1024
 CONST = 1997.3794084376191
+VITERBI_BAND = 30
@@ -13,7 +13,13 @@ from .utils import to_local_average_f0, to_viterbi_f0
 
 
 class RMVPE(BasePE):
-    def __init__(self, model_path, hop_length=160):
+    def __init__(self, model_path, hop_length=160, chunk_length=None, chunk_overlap=1.):
+        """
+        :param chunk_length: if not None, run the model on chunks of this length (in seconds)
+            to keep the peak memory constant regardless of the input length
+        :param chunk_overlap: length (in seconds) of the overlapping region of adjacent chunks,
+            over which their outputs are crossfaded
+        """
         self.resample_kernel = {}
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
         self.model = E2E0(4, 1, (2, 2)).eval().to(self.device)
@@ -22,14 +28,49 @@ class RMVPE(BasePE):
         self.mel_extractor = MelSpectrogram(
             N_MELS, SAMPLE_RATE, WINDOW_LENGTH, hop_length, None, MEL_FMIN, MEL_FMAX
         ).to(self.device)
+        if chunk_length is None:
+            self.chunk_frames = self.chunk_overlap_frames = None
+        else:
+            frames_per_second = SAMPLE_RATE / hop_length
+            self.chunk_overlap_frames = int(np.ceil(chunk_overlap * frames_per_second))
+            # the model requires the number of frames to be a multiple of 32
+            self.chunk_frames = 32 * int(np.ceil(chunk_length * frames_per_second / 32))
+            assert self.chunk_frames > self.chunk_overlap_frames, 'Chunk length must be longer than the overlap.'
 
     @torch.no_grad()
     def mel2hidden(self, mel):
         n_frames = mel.shape[-1]
+        if self.chunk_frames is not None and n_frames > self.chunk_frames:
+            return self.mel2hidden_chunked(mel)
         mel = F.pad(mel, (0, 32 * ((n_frames - 1) // 32 + 1) - n_frames), mode='constant')
         hidden = self.model(mel)
         return hidden[:, :n_frames]
 
+    @torch.no_grad()
+    def mel2hidden_chunked(self, mel):
+        """
+        Run the model on overlapping chunks and linearly crossfade the outputs in the overlapping regions.
+        """
+        n_frames = mel.shape[-1]
+        chunk, overlap = self.chunk_frames, self.chunk_overlap_frames
+        fade_in = torch.arange(1, overlap + 1, device=mel.device) / (overlap + 1)
+        hidden = mel.new_zeros(mel.shape[0], n_frames, N_CLASS)
+        weight = mel.new_zeros(n_frames)
+        start = 0
+        while True:
+            end = min(start + chunk, n_frames)
+            chunk_weight = mel.new_ones(end - start)
+            if start > 0:
+                chunk_weight[:overlap] = fade_in
+            if end < n_frames:
+                chunk_weight[end - start - overlap:] = fade_in.flip(0)
+            hidden[:, start: end] += self.mel2hidden(mel[..., start: end]) * chunk_weight[None, :, None]
+            weight[start: end] += chunk_weight
+            if end == n_frames:
+                break
+            start = end - overlap
+        return hidden / weight[None, :, None]
+
     def decode(self, hidden, thred=0.03, use_viterbi=False):
         if use_viterbi:
             f0 = to_viterbi_f0(hidden, thred=thred)
@@ -37,23 +78,49 @@ class RMVPE(BasePE):
             f0 = to_local_average_f0(hidden, thred=thred)
         return f0
 
+    def resample(self, audio, sample_rate):
+        if sample_rate == 16000:
+            return audio
+        key_str = str(sample_rate)
+        if key_str not in self.resample_kernel:
+            self.resample_kernel[key_str] = Resample(sample_rate, 16000, lowpass_filter_width=128)
+        self.resample_kernel[key_str] = self.resample_kernel[key_str].to(self.device)
+        return self.resample_kernel[key_str](audio)
+
     def infer_from_audio(self, audio, sample_rate=16000, thred=0.03, use_viterbi=False):
         audio = torch.from_numpy(audio).float().unsqueeze(0).to(self.device)
-        if sample_rate == 16000:
-            audio_res = audio
-        else:
-            key_str = str(sample_rate)
-            if key_str not in self.resample_kernel:
-                self.resample_kernel[key_str] = Resample(sample_rate, 16000, lowpass_filter_width=128)
-            self.resample_kernel[key_str] = self.resample_kernel[key_str].to(self.device)
-            audio_res = self.resample_kernel[key_str](audio)
+        audio_res = self.resample(audio, sample_rate)
         mel = self.mel_extractor(audio_res, center=True)
         hidden = self.mel2hidden(mel)
         f0 = self.decode(hidden, thred=thred, use_viterbi=use_viterbi)
         return f0
 
-    def get_pitch(self, waveform, length, hparams, interp_uv=False, speed=1):
-        f0 = self.infer_from_audio(waveform, sample_rate=hparams['audio_sample_rate'])
+    def infer_from_audio_batch(self, audios, sample_rate=16000, thred=0.03, use_viterbi=False):
+        """
+        Run inference on a batch of waveforms in one forward pass. Mel frames beyond the end
+        of each waveform are padded with zeros, like infer_from_audio() does to round up
+        the number of frames. The GRU layers read the padding backwards, so results of
+        the shorter waveforms may slightly differ from infer_from_audio(). Batching
+        waveforms of similar lengths keeps the difference (and wasted computation) small.
+        """
+        audio = torch.zeros(len(audios), max(len(a) for a in audios))
+        for i, a in enumerate(audios):
+            audio[i, :len(a)] = torch.from_numpy(a).float()
+        audio_res = self.resample(audio.to(self.device), sample_rate)
+        n_frames = [
+            int(np.ceil(len(a) * 16000 / sample_rate)) // self.mel_extractor.hop_length + 1
+            for a in audios
+        ]
+        mel = self.mel_extractor(audio_res, center=True)
+        for i, n in enumerate(n_frames):
+            mel[i, :, n:] = 0
+        hidden = self.mel2hidden(mel)
+        return [
+            self.decode(hidden[i: i + 1, :n], thred=thred, use_viterbi=use_viterbi)
+            for i, n in enumerate(n_frames)
+        ]
+
+    def postprocess_pitch(self, f0, length, hparams, interp_uv=False, speed=1):
         uv = f0 == 0
         f0, uv = interp_f0(f0, uv)
 
@@ -64,3 +131,14 @@ class RMVPE(BasePE):
         if not interp_uv:
             f0_res[uv_res] = 0
         return f0_res, uv_res
+
+    def get_pitch(self, waveform, length, hparams, interp_uv=False, speed=1):
+        f0 = self.infer_from_audio(waveform, sample_rate=hparams['audio_sample_rate'])
+        return self.postprocess_pitch(f0, length, hparams, interp_uv=interp_uv, speed=speed)
+
+    def get_pitch_batch(self, waveforms, lengths, hparams, interp_uv=False, speed=1):
+        f0s = self.infer_from_audio_batch(waveforms, sample_rate=hparams['audio_sample_rate'])
+        return [
+            self.postprocess_pitch(f0, length, hparams, interp_uv=interp_uv, speed=speed)
+            for f0, length in zip(f0s, lengths)
+        ]
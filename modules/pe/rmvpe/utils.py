@@ -1,6 +1,6 @@
-import librosa
 import numpy as np
 import torch
+import torch.nn.functional as F
 
 from .constants import *
 
@@ -24,20 +24,54 @@ def to_local_average_f0(hidden, center=None, thred=0.03):
 
 
 def to_viterbi_f0(hidden, thred=0.03):
-    # Create viterbi transition matrix
+    """
+    Viterbi decoding with the transition matrix of |i - j| < 30, batched and run on the device of hidden.
+    Equivalent to librosa.sequence.viterbi with the dense transition matrix: transitions in the band are
+    computed from neighbouring states, and the zero-probability transitions out of the band (log(tiny)
+    after smoothing, as in librosa) are covered by a jump from the best state of the previous frame.
+    """
+    # Create viterbi transition band: log_trans_band[j, k] = log(transition[j + k - 29, j])
+    key = str(hidden.device)
     if not hasattr(to_viterbi_f0, 'transition'):
+        to_viterbi_f0.transition = {}
+    if key not in to_viterbi_f0.transition:
         xx, yy = np.meshgrid(range(N_CLASS), range(N_CLASS))
         transition = np.maximum(30 - abs(xx - yy), 0)
         transition = transition / transition.sum(axis=1, keepdims=True)
-        to_viterbi_f0.transition = transition
+        band = np.full((N_CLASS, 2 * VITERBI_BAND - 1), -np.inf)
+        for k in range(2 * VITERBI_BAND - 1):
+            j = np.arange(max(0, VITERBI_BAND - 1 - k), min(N_CLASS, N_CLASS + VITERBI_BAND - 1 - k))
+            band[j, k] = np.log(transition[j + k - VITERBI_BAND + 1, j] + np.finfo(np.float32).tiny)
+        to_viterbi_f0.transition[key] = torch.from_numpy(band).to(hidden.device)
+    log_trans_band = to_viterbi_f0.transition[key]
 
-    # Convert to probability
-    prob = hidden.squeeze(0).cpu().numpy()
-    prob = prob.T
-    prob = prob / prob.sum(axis=0)
+    # Convert to log probability
+    prob = hidden / hidden.sum(dim=2, keepdim=True)  # [B, T, N]
+    log_prob = torch.log(prob + torch.finfo(prob.dtype).tiny).double()
+    log_tiny = np.log(torch.finfo(prob.dtype).tiny)
+    n_frames = log_prob.shape[1]
 
     # Perform viterbi decoding
-    path = librosa.sequence.viterbi(prob, to_viterbi_f0.transition).astype(np.int64)
-    center = torch.from_numpy(path).unsqueeze(0).unsqueeze(-1).to(hidden.device)
+    value = log_prob[:, 0] - np.log(N_CLASS)  # [B, N]
+    ptr = torch.empty(log_prob.shape, dtype=torch.long, device=hidden.device)  # [B, T, N]
+    offsets = torch.arange(N_CLASS, device=hidden.device) - (VITERBI_BAND - 1)  # [N]
+    for t in range(1, n_frames):
+        # trans_out[b, j, k] = value[b, j + k - 29] + log_trans_band[j, k]
+        trans_out = F.pad(
+            value, (VITERBI_BAND - 1, VITERBI_BAND - 1), value=-np.inf
+        ).unfold(1, 2 * VITERBI_BAND - 1, 1) + log_trans_band
+        best, best_k = trans_out.max(dim=2)
+        # If the best state of the previous frame is in the band of j, the band already covers it;
+        # otherwise, a jump from it (which is out of the band) may still beat all transitions in the band.
+        jump, jump_i = value.max(dim=1, keepdim=True)
+        jump = jump + log_tiny
+        use_jump = jump > best
+        ptr[:, t] = torch.where(use_jump, jump_i, best_k + offsets)
+        value = log_prob[:, t] + torch.where(use_jump, jump, best)
+    path = torch.empty(log_prob.shape[:2], dtype=torch.long, device=hidden.device)  # [B, T]
+    path[:, -1] = value.argmax(dim=1)
+    for t in range(n_frames - 2, -1, -1):
+        path[:, t] = ptr[:, t + 1].gather(1, path[:, t + 1: t + 2])[:, 0]
+    center = path.unsqueeze(-1)
 
     return to_local_average_f0(hidden, center=center, thred=thred)
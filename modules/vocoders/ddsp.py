@@ -1,3 +1,4 @@
+import functools
 import os
 import pathlib
 
@@ -70,6 +71,41 @@ class Audio2Mel(torch.nn.Module):
               audio: B x C x T
         log_mel_spec: B x T_ x C x n_mel 
         '''
+        B, C, T = audio.shape
+        audio = audio.reshape(B * C, T)
+        log_mel_spec = self.get_log_mel(audio, keyshift=keyshift, speed=speed, center=True)
+
+        # log_mel_spec: B x C, M, T
+        T_ = log_mel_spec.shape[-1]
+        log_mel_spec = log_mel_spec.reshape(B, C, self.n_mel_channels, T_)
+        log_mel_spec = log_mel_spec.permute(0, 3, 1, 2)
+
+        # print('og_mel_spec:', log_mel_spec.shape)
+        log_mel_spec = log_mel_spec.squeeze(2)  # mono
+        return log_mel_spec
+
+    def forward_batch(self, audios, keyshift=0, speed=1):
+        '''
+        audios: list of 1-D waveforms of different lengths
+        return: list of log_mel_spec: T_i x n_mel, the same as calling forward() on each waveform
+        '''
+        n_fft_new = int(np.round(self.n_fft * 2 ** (keyshift / 12)))
+        hop_length_new = int(np.round(self.hop_length * speed))
+        # pad each waveform like torch.stft(center=True) does, before stacking them
+        padded = [
+            F.pad(audio[None, None], (n_fft_new // 2, n_fft_new // 2), mode='reflect')[0, 0]
+            for audio in audios
+        ]
+        n_frames = [(len(audio) - n_fft_new) // hop_length_new + 1 for audio in padded]
+        audio = torch.nn.utils.rnn.pad_sequence(padded, batch_first=True)
+        log_mel_spec = self.get_log_mel(audio, keyshift=keyshift, speed=speed, center=False)
+        return [log_mel_spec[i, :, :n].T for i, n in enumerate(n_frames)]
+
+    def get_log_mel(self, audio, keyshift=0, speed=1, center=True):
+        '''
+              audio: B x T
+        log_mel_spec: B x n_mel x T_
+        '''
         factor = 2 ** (keyshift / 12)
         n_fft_new = int(np.round(self.n_fft * factor))
         win_length_new = int(np.round(self.win_length * factor))
@@ -79,15 +115,13 @@ class Audio2Mel(torch.nn.Module):
         if keyshift_key not in self.hann_window:
             self.hann_window[keyshift_key] = torch.hann_window(win_length_new).to(audio.device)
 
-        B, C, T = audio.shape
-        audio = audio.reshape(B * C, T)
         fft = torch.stft(
             audio,
             n_fft=n_fft_new,
             hop_length=hop_length_new,
             win_length=win_length_new,
             window=self.hann_window[keyshift_key],
-            center=True,
+            center=center,
             return_complex=False)
         real_part, imag_part = fft.unbind(-1)
         magnitude = torch.sqrt(real_part ** 2 + imag_part ** 2)
@@ -101,15 +135,24 @@ class Audio2Mel(torch.nn.Module):
 
         mel_output = torch.matmul(self.mel_basis, magnitude)
         log_mel_spec = torch.log10(torch.clamp(mel_output, min=self.clamp))
+        return log_mel_spec
 
-        # log_mel_spec: B x C, M, T
-        T_ = log_mel_spec.shape[-1]
-        log_mel_spec = log_mel_spec.reshape(B, C, self.n_mel_channels, T_)
-        log_mel_spec = log_mel_spec.permute(0, 3, 1, 2)
 
-        # print('og_mel_spec:', log_mel_spec.shape)
-        log_mel_spec = log_mel_spec.squeeze(2)  # mono
-        return log_mel_spec
+@functools.lru_cache(maxsize=None)
+def get_audio2mel(hop_length, sampling_rate, n_mel_channels, win_length, n_fft, mel_fmin, mel_fmax, device):
+    """
+    Get the process-wide Audio2Mel instance with the given parameters on the given device, so that
+    its mel basis and Hann windows (one for each key shift) are built only once.
+    """
+    return Audio2Mel(
+        hop_length=hop_length,
+        sampling_rate=sampling_rate,
+        n_mel_channels=n_mel_channels,
+        win_length=win_length,
+        n_fft=n_fft,
+        mel_fmin=mel_fmin,
+        mel_fmax=mel_fmax
+    ).to(device)
 
 
 @register_vocoder
@@ -197,19 +240,40 @@ class DDSP(BaseVocoder):
         mel_fmax = hparams['fmax']
 
         # load input
-        x, _ = librosa.load(inp_path, sr=sampling_rate)
+        if isinstance(inp_path, np.ndarray):
+            x = inp_path
+        else:
+            x, _ = librosa.load(inp_path, sr=sampling_rate)
         x_t = torch.from_numpy(x).float().to(device)
         x_t = x_t.unsqueeze(0).unsqueeze(0)  # (T,) --> (1, 1, T)
 
         # mel analysis
-        mel_extractor = Audio2Mel(
-            hop_length=hop_length,
-            sampling_rate=sampling_rate,
-            n_mel_channels=n_mel_channels,
-            win_length=win_length,
-            n_fft=n_fft,
-            mel_fmin=mel_fmin,
-            mel_fmax=mel_fmax).to(device)
+        mel_extractor = get_audio2mel(
+            hop_length, sampling_rate, n_mel_channels, win_length, n_fft, mel_fmin, mel_fmax, str(device)
+        )
 
         mel = mel_extractor(x_t, keyshift=keyshift, speed=speed)
         return x, mel.squeeze(0).cpu().numpy()
+
+    @staticmethod
+    def wav2spec_batch(inp_paths, keyshift=0, speed=1, device=None):
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        sampling_rate = hparams['audio_sample_rate']
+
+        # load input
+        xs = [
+            inp_path if isinstance(inp_path, np.ndarray) else librosa.load(inp_path, sr=sampling_rate)[0]
+            for inp_path in inp_paths
+        ]
+
+        # mel analysis
+        mel_extractor = get_audio2mel(
+            hparams['hop_size'], sampling_rate, hparams['audio_num_mel_bins'], hparams['win_size'],
+            hparams['fft_size'], hparams['fmin'], hparams['fmax'], str(device)
+        )
+        with torch.no_grad():
+            mels = mel_extractor.forward_batch(
+                [torch.from_numpy(x).float().to(device) for x in xs], keyshift=keyshift, speed=speed
+            )
+        return [(x, mel.cpu().numpy()) for x, mel in zip(xs, mels)]
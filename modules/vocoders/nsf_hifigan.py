@@ -1,5 +1,6 @@
 import pathlib
 
+import numpy as np
 import torch
 
 try:
@@ -8,7 +9,7 @@ except ModuleNotFoundError:
     rank_zero_info = print
 
 from modules.nsf_hifigan.models import load_model
-from modules.nsf_hifigan.nvSTFT import load_wav_to_torch, STFT
+from modules.nsf_hifigan.nvSTFT import load_wav_to_torch, get_stft
 from basics.base_vocoder import BaseVocoder
 from modules.vocoders.registry import register_vocoder
 from utils.hparams import hparams
@@ -105,10 +106,36 @@ class NsfHifiGAN(BaseVocoder):
         hop_size = hparams['hop_size']
         fmin = hparams['fmin']
         fmax = hparams['fmax']
-        stft = STFT(sampling_rate, num_mels, n_fft, win_size, hop_size, fmin, fmax)
+        stft = get_stft(sampling_rate, num_mels, n_fft, win_size, hop_size, fmin, fmax)
         with torch.no_grad():
-            wav_torch, _ = load_wav_to_torch(inp_path, target_sr=stft.target_sr)
+            if isinstance(inp_path, np.ndarray):
+                wav_torch = torch.from_numpy(inp_path)
+            else:
+                wav_torch, _ = load_wav_to_torch(inp_path, target_sr=stft.target_sr)
             mel_torch = stft.get_mel(wav_torch.unsqueeze(0).to(device), keyshift=keyshift, speed=speed).squeeze(0).T
             # log mel to log10 mel
             mel_torch = 0.434294 * mel_torch
             return wav_torch.cpu().numpy(), mel_torch.cpu().numpy()
+
+    @staticmethod
+    def wav2spec_batch(inp_paths, keyshift=0, speed=1, device=None):
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        stft = get_stft(
+            hparams['audio_sample_rate'], hparams['audio_num_mel_bins'], hparams['fft_size'],
+            hparams['win_size'], hparams['hop_size'], hparams['fmin'], hparams['fmax']
+        )
+        with torch.no_grad():
+            wavs_torch = [
+                torch.from_numpy(inp_path) if isinstance(inp_path, np.ndarray)
+                else load_wav_to_torch(inp_path, target_sr=stft.target_sr)[0]
+                for inp_path in inp_paths
+            ]
+            mels_torch = stft.get_mel_batch(
+                [wav_torch.to(device) for wav_torch in wavs_torch], keyshift=keyshift, speed=speed
+            )
+            # log mel to log10 mel
+            return [
+                (wav_torch.cpu().numpy(), (0.434294 * mel_torch.T).cpu().numpy())
+                for wav_torch, mel_torch in zip(wavs_torch, mels_torch)
+            ]
@@ -24,7 +24,9 @@ from utils.binarizer_utils import (
     SinusoidalSmoothingConv1d,
     get_mel2ph_torch,
     get_energy_librosa,
-    get_breathiness_pyworld
+    get_breathiness_pyworld,
+    load_wav_cached,
+    set_wav_cache_size
 )
 from utils.hparams import hparams
 
@@ -32,6 +34,7 @@ os.environ["OMP_NUM_THREADS"] = "1"
 ACOUSTIC_ITEM_ATTRIBUTES = [
     'spk_id',
     'mel',
+    'mel_range',
     'tokens',
     'mel2ph',
     'f0',
@@ -49,9 +52,18 @@ breathiness_smooth: SinusoidalSmoothingConv1d = None
 class AcousticBinarizer(BaseBinarizer):
     def __init__(self):
         super().__init__(data_attrs=ACOUSTIC_ITEM_ATTRIBUTES)
-        self.lr = LengthRegulator()
+        self.lr = LengthRegulator(mode='search')
         self.need_energy = hparams.get('use_energy_embed', False)
         self.need_breathiness = hparams.get('use_breathiness_embed', False)
+        self.approximate_breathiness = self.binarization_args.get('approximate_breathiness', False)
+        self.preprocessing_hparams += [
+            'audio_num_mel_bins', 'vocoder', 'interp_uv',
+            'use_energy_embed', 'energy_smooth_width', 'use_breathiness_embed', 'breathiness_smooth_width',
+            'use_key_shift_embed', 'use_speed_embed'
+        ]
+        self.mel_storage = self.binarization_args.get('mel_storage', 'float32')
+        assert self.mel_storage in ['float32', 'float16', 'uint8'], \
+            f'Unknown mel storage type: {self.mel_storage}'
 
     def load_meta_data(self, raw_data_dir: pathlib.Path, ds_id, spk_id):
         meta_data_dict = {}
@@ -76,14 +88,103 @@ class AcousticBinarizer(BaseBinarizer):
                 'migrating it to the new format via the following command:\n'
                 'python scripts/migrate.py txt <INPUT_TXT>'
             )
-        self.items.update(meta_data_dict)
+        return meta_data_dict
+
+    def initialize_worker(self):
+        global pitch_extractor
+        if pitch_extractor is None:
+            # prepare_batch decodes the whole batch before any augmentation of it runs
+            set_wav_cache_size(max(4, self.binarization_args.get('batch_size', 1)))
+            pitch_extractor = initialize_pe(cache=self.feature_cache)
+
+    def preprocessing_signature(self):
+        return (
+            f'{super().preprocessing_signature()}:mel_storage={self.mel_storage}'
+            f':approximate_breathiness={self.approximate_breathiness}'
+        )
+
+    def dataset_metadata(self):
+        return {'mel_storage': self.mel_storage}
+
+    def restore_item(self, item_name, meta_data, reuse):
+        item = super().restore_item(item_name, meta_data, reuse)
+        item['ph_dur'] = np.array(meta_data['ph_dur']).astype(np.float32)
+        return item
+
+    def process_item_with_augmentation(self, item_name, meta_data, binarization_args, aug_tasks, reuse=None):
+        from augmentation.spec_stretch import SpectrogramStretchAugmentation
+        # Augmentation shares the pitch extractor (and its feature cache) of this worker. Restored items
+        # skip process_item, so the worker may not have been initialized yet.
+        self.initialize_worker()
+        for task in aug_tasks:
+            aug_ins = getattr(task['func'], '__self__', None)
+            if isinstance(aug_ins, SpectrogramStretchAugmentation):
+                aug_ins.pe = pitch_extractor
+        items = super().process_item_with_augmentation(item_name, meta_data, binarization_args, aug_tasks, reuse)
+        if items is None:
+            return None
+        return [self.compress_mel(item) for item in items]
+
+    def compress_mel(self, item):
+        """
+        Convert the mel spectrogram to its storage type. Items restored from previous
+        binary data (see restore_item) are already converted.
+        float16: mel is stored in half precision;
+        uint8: mel is linearly quantized to [0, 255] between its minimum and maximum,
+            which are stored in mel_range.
+        """
+        mel = item['mel']
+        if self.mel_storage == 'float16':
+            item['mel'] = mel.astype(np.float16)
+        elif self.mel_storage == 'uint8' and mel.dtype != np.uint8:
+            mel_min, mel_max = mel.min(), mel.max()
+            scale = max(mel_max - mel_min, 1e-5) / 255
+            item['mel'] = np.round((mel - mel_min) / scale).astype(np.uint8)
+            item['mel_range'] = np.array([mel_min, mel_max], dtype=np.float32)
+        return item
+
+    @staticmethod
+    def vocoder_cls():
+        if hparams['vocoder'] in VOCODERS:
+            return VOCODERS[hparams['vocoder']]
+        else:
+            return VOCODERS[hparams['vocoder'].split('.')[-1]]
+
+    def wav2spec(self, wav_fn):
+        return self.vocoder_cls().wav2spec(load_wav_cached(wav_fn, hparams['audio_sample_rate']))
+
+    @torch.no_grad()
+    def prepare_batch(self, batch_args):
+        self.initialize_worker()
+        names, wav_fns = [], []
+        for item_name, meta_data, _, _, reuse in batch_args:
+            if reuse is None:
+                names.append(item_name)
+                wav_fns.append(meta_data['wav_fn'])
+        if len(names) == 0:
+            return
+        if self.device.type == 'cuda':
+            # Batched STFT saves kernel launches on GPUs, but costs more than it saves
+            # on CPUs because of the padding.
+            specs = self.vocoder_cls().wav2spec_batch([
+                load_wav_cached(wav_fn, hparams['audio_sample_rate']) for wav_fn in wav_fns
+            ])
+        else:
+            specs = [self.wav2spec(wav_fn) for wav_fn in wav_fns]
+        wavs = [wav for wav, _ in specs]
+        pitches = pitch_extractor.get_pitch_batch(
+            wavs, [mel.shape[0] for _, mel in specs], hparams, interp_uv=hparams['interp_uv']
+        )
+        for item_name, (wav, mel), (f0, uv) in zip(names, specs, pitches):
+            self.prepared[item_name] = {'wav': wav, 'mel': mel, 'f0': f0, 'uv': uv}
 
     @torch.no_grad()
     def process_item(self, item_name, meta_data, binarization_args):
-        if hparams['vocoder'] in VOCODERS:
-            wav, mel = VOCODERS[hparams['vocoder']].wav2spec(meta_data['wav_fn'])
+        prepared = self.prepared.get(item_name)
+        if prepared is not None:
+            wav, mel = prepared['wav'], prepared['mel']
         else:
-            wav, mel = VOCODERS[hparams['vocoder'].split('.')[-1]].wav2spec(meta_data['wav_fn'])
+            wav, mel = self.wav2spec(meta_data['wav_fn'])
         length = mel.shape[0]
         seconds = length * hparams['hop_size'] / hparams['audio_sample_rate']
         processed_input = {
@@ -103,12 +204,13 @@ class AcousticBinarizer(BaseBinarizer):
         ).cpu().numpy()
 
         # get ground truth f0
-        global pitch_extractor
-        if pitch_extractor is None:
-            pitch_extractor = initialize_pe()
-        gt_f0, uv = pitch_extractor.get_pitch(
-            wav, length, hparams, interp_uv=hparams['interp_uv']
-        )
+        if prepared is not None:
+            gt_f0, uv = prepared['f0'], prepared['uv']
+        else:
+            self.initialize_worker()
+            gt_f0, uv = pitch_extractor.get_pitch(
+                wav, length, hparams, interp_uv=hparams['interp_uv']
+            )
         if uv.all():  # All unvoiced
             print(f'Skipped \'{item_name}\': empty gt f0')
             return None
@@ -116,7 +218,7 @@ class AcousticBinarizer(BaseBinarizer):
 
         if self.need_energy:
             # get ground truth energy
-            energy = get_energy_librosa(wav, length, hparams).astype(np.float32)
+            energy = get_energy_librosa(wav, length, hparams, cache=self.feature_cache).astype(np.float32)
 
             global energy_smooth
             if energy_smooth is None:
@@ -129,7 +231,10 @@ class AcousticBinarizer(BaseBinarizer):
 
         if self.need_breathiness:
             # get ground truth breathiness
-            breathiness = get_breathiness_pyworld(wav, gt_f0 * ~uv, length, hparams).astype(np.float32)
+            breathiness = get_breathiness_pyworld(
+                wav, gt_f0 * ~uv, length, hparams,
+                approximate=self.approximate_breathiness, cache=self.feature_cache
+            ).astype(np.float32)
 
             global breathiness_smooth
             if breathiness_smooth is None:
@@ -148,12 +253,28 @@ class AcousticBinarizer(BaseBinarizer):
 
         return processed_input
 
+    def restore_data_augmentation(self, aug_args_map):
+        from augmentation.spec_stretch import SpectrogramStretchAugmentation
+        # all types of augmentation are done by SpectrogramStretchAugmentation.process_item with different kwargs
+        aug_ins = SpectrogramStretchAugmentation(self.raw_data_dirs, {})
+        return {
+            item_name: [
+                {
+                    'name': item_name,
+                    'func': aug_ins.process_item,
+                    'kwargs': kwargs
+                }
+                for kwargs in aug_args
+            ]
+            for item_name, aug_args in aug_args_map.items()
+            if len(aug_args) > 0
+        }
+
     def arrange_data_augmentation(self, data_iterator):
         aug_map = {}
         aug_list = []
         all_item_names = [item_name for item_name, _ in data_iterator]
         total_scale = 0
-        aug_pe = initialize_pe()
         if self.augmentation_args['random_pitch_shifting']['enabled']:
             from augmentation.spec_stretch import SpectrogramStretchAugmentation
             aug_args = self.augmentation_args['random_pitch_shifting']
@@ -163,7 +284,7 @@ class AcousticBinarizer(BaseBinarizer):
             assert key_shift_min < 0 < key_shift_max, \
                 'Random pitch shifting augmentation must have a range where min < 0 < max.'
 
-            aug_ins = SpectrogramStretchAugmentation(self.raw_data_dirs, aug_args, pe=aug_pe)
+            aug_ins = SpectrogramStretchAugmentation(self.raw_data_dirs, aug_args)
             scale = aug_args['scale']
             aug_item_names = random.choices(all_item_names, k=int(scale * len(all_item_names)))
 
@@ -202,7 +323,7 @@ class AcousticBinarizer(BaseBinarizer):
                 f'Fixed pitch shifting augmentation requires num_spk >= (1 + len(targets)) * (max(spk_ids) + 1).'
             assert scale < 1, 'Fixed pitch shifting augmentation requires scale < 1.'
 
-            aug_ins = SpectrogramStretchAugmentation(self.raw_data_dirs, aug_args, pe=aug_pe)
+            aug_ins = SpectrogramStretchAugmentation(self.raw_data_dirs, aug_args)
             for i, target in enumerate(targets):
                 aug_item_names = random.choices(all_item_names, k=int(scale * len(all_item_names)))
                 for aug_item_name in aug_item_names:
@@ -231,7 +352,7 @@ class AcousticBinarizer(BaseBinarizer):
                 'Random time stretching augmentation must have a range where 0 < min < 1 < max.'
             assert domain in ['log', 'linear'], 'domain must be \'log\' or \'linear\'.'
 
-            aug_ins = SpectrogramStretchAugmentation(self.raw_data_dirs, aug_args, pe=aug_pe)
+            aug_ins = SpectrogramStretchAugmentation(self.raw_data_dirs, aug_args)
             scale = aug_args['scale']
             k_from_raw = int(scale / (1 + total_scale) * len(all_item_names))
             k_from_aug = int(total_scale * scale / (1 + total_scale) * len(all_item_names))
@@ -2,6 +2,7 @@ import csv
 import json
 import os
 import pathlib
+from collections import Counter, OrderedDict
 
 import librosa
 import numpy as np
@@ -39,6 +40,9 @@ VARIANCE_ITEM_ATTRIBUTES = [
     'breathiness',  # frame-level RMS of aperiodic parts (dB), float32[T_s,]
 ]
 DS_INDEX_SEP = '#'
+# Number of parsed DS files kept in memory. Attributes of one item (and segments of one DS file)
+# are read consecutively, so a small cache is enough to avoid parsing the same file repeatedly.
+DS_CACHE_SIZE = 64
 
 # These operators are used as global variables due to a PyTorch shared memory bug on Windows platforms.
 # See https://github.com/pytorch/pytorch/issues/100358
@@ -55,16 +59,47 @@ class VarianceBinarizer(BaseBinarizer):
         predict_energy = hparams['predict_energy']
         predict_breathiness = hparams['predict_breathiness']
         self.predict_variances = predict_energy or predict_breathiness
-        self.lr = LengthRegulator().to(self.device)
+        self.lr = LengthRegulator(mode='search').to(self.device)
         self.prefer_ds = self.binarization_args['prefer_ds']
-        self.cached_ds = {}
+        self.approximate_breathiness = self.binarization_args.get('approximate_breathiness', False)
+        self.cached_ds = OrderedDict()
+        self.preprocessing_hparams += [
+            'predict_dur', 'predict_pitch', 'predict_energy', 'predict_breathiness',
+            'midi_smooth_width', 'energy_smooth_width', 'breathiness_smooth_width'
+        ]
+
+    def initialize_worker(self):
+        global pitch_extractor
+        if pitch_extractor is None:
+            pitch_extractor = initialize_pe(cache=self.feature_cache)
+
+    def preprocessing_signature(self):
+        # prefer_ds decides where the features come from
+        return (
+            f'{super().preprocessing_signature()}:prefer_ds={self.prefer_ds}'
+            f':approximate_breathiness={self.approximate_breathiness}'
+        )
+
+    def item_dependencies(self, item_name, meta_data):
+        dependencies = super().item_dependencies(item_name, meta_data)
+        if self.prefer_ds:
+            ds_id, name = item_name.split(':', maxsplit=1)
+            name = name.rsplit(DS_INDEX_SEP, maxsplit=1)[0]
+            ds_dir = self.raw_data_dirs[int(ds_id)] / 'ds'
+            dependencies += [
+                ds_dir / f'{name}{DS_INDEX_SEP}{meta_data["ds_idx"]}.ds',
+                ds_dir / f'{name}.ds'
+            ]
+        return dependencies
 
     def load_attr_from_ds(self, ds_id, name, attr, idx=0):
         item_name = f'{ds_id}:{name}'
         item_name_with_idx = f'{item_name}{DS_INDEX_SEP}{idx}'
         if item_name_with_idx in self.cached_ds:
+            self.cached_ds.move_to_end(item_name_with_idx)
             ds = self.cached_ds[item_name_with_idx][0]
         elif item_name in self.cached_ds:
+            self.cached_ds.move_to_end(item_name)
             ds = self.cached_ds[item_name][idx]
         else:
             ds_path = self.raw_data_dirs[ds_id] / 'ds' / f'{name}{DS_INDEX_SEP}{idx}.ds'
@@ -80,6 +115,8 @@ class VarianceBinarizer(BaseBinarizer):
             if not isinstance(ds, list):
                 ds = [ds]
             self.cached_ds[cache_key] = ds
+            if len(self.cached_ds) > DS_CACHE_SIZE:
+                self.cached_ds.popitem(last=False)
             ds = ds[idx]
         return ds.get(attr)
 
@@ -130,7 +167,7 @@ class VarianceBinarizer(BaseBinarizer):
 
             meta_data_dict[f'{ds_id}:{item_name}'] = temp_dict
 
-        self.items.update(meta_data_dict)
+        return meta_data_dict
 
     def check_coverage(self):
         super().check_coverage()
@@ -138,16 +175,13 @@ class VarianceBinarizer(BaseBinarizer):
             return
 
         # MIDI pitch distribution summary
-        midi_map = {}
-        for item_name in self.items:
-            for midi in self.items[item_name]['note_seq']:
-                if midi == 'rest':
-                    continue
-                midi = librosa.note_to_midi(midi, round_midi=True)
-                if midi in midi_map:
-                    midi_map[midi] += 1
-                else:
-                    midi_map[midi] = 1
+        note_counts = Counter()
+        for meta_data in self.items.values():
+            note_counts.update(meta_data['note_seq'])
+        note_counts.pop('rest', None)
+        midi_map = Counter()
+        for note, count in note_counts.items():
+            midi_map[librosa.note_to_midi(note, round_midi=True)] += count
 
         print('===== MIDI Pitch Distribution Summary =====')
         for i, key in enumerate(sorted(midi_map.keys())):
@@ -173,6 +207,27 @@ class VarianceBinarizer(BaseBinarizer):
                     pad_inches=0.25)
         print(f'| save summary to \'{filename}\'')
 
+    def prepare_batch(self, batch_args):
+        self.initialize_worker()
+        names, waveforms, lengths = [], [], []
+        for item_name, meta_data, _, _, reuse in batch_args:
+            if reuse is not None or not pathlib.Path(meta_data['wav_fn']).exists():
+                continue
+            if self.prefer_ds:
+                ds_id, name = item_name.split(':', maxsplit=1)
+                name = name.rsplit(DS_INDEX_SEP, maxsplit=1)[0]
+                if self.load_attr_from_ds(int(ds_id), name, 'f0_seq', idx=meta_data['ds_idx']) is not None:
+                    continue
+            waveform, _ = librosa.load(meta_data['wav_fn'], sr=hparams['audio_sample_rate'], mono=True)
+            names.append(item_name)
+            waveforms.append(waveform)
+            lengths.append(round(sum(meta_data['ph_dur']) / self.timestep))
+        if len(names) == 0:
+            return
+        pitches = pitch_extractor.get_pitch_batch(waveforms, lengths, hparams, interp_uv=True)
+        for item_name, waveform, (f0, uv) in zip(names, waveforms, pitches):
+            self.prepared[item_name] = {'waveform': waveform, 'f0': f0, 'uv': uv}
+
     @torch.no_grad()
     def process_item(self, item_name, meta_data, binarization_args):
         ds_id, name = item_name.split(':', maxsplit=1)
@@ -204,16 +259,17 @@ class VarianceBinarizer(BaseBinarizer):
             processed_input['mel2ph'] = mel2ph.cpu().numpy()
 
         # Below: extract actual f0, convert to pitch and calculate delta pitch
-        if pathlib.Path(meta_data['wav_fn']).exists():
+        prepared = self.prepared.get(item_name)
+        if prepared is not None:
+            waveform = prepared['waveform']
+        elif pathlib.Path(meta_data['wav_fn']).exists():
             waveform, _ = librosa.load(meta_data['wav_fn'], sr=hparams['audio_sample_rate'], mono=True)
         elif not self.prefer_ds:
             raise FileNotFoundError(meta_data['wav_fn'])
         else:
             waveform = None
 
-        global pitch_extractor
-        if pitch_extractor is None:
-            pitch_extractor = initialize_pe()
+        self.initialize_worker()
         f0 = uv = None
         if self.prefer_ds:
             f0_seq = self.load_attr_from_ds(ds_id, name, 'f0_seq', idx=ds_seg_idx)
@@ -226,6 +282,8 @@ class VarianceBinarizer(BaseBinarizer):
                 )
                 uv = f0 == 0
                 f0, _ = interp_f0(f0, uv)
+        if f0 is None and prepared is not None:
+            f0, uv = prepared['f0'], prepared['uv']
         if f0 is None:
             f0, uv = pitch_extractor.get_pitch(waveform, length, hparams, interp_uv=True)
         if uv.all():  # All unvoiced
@@ -291,7 +349,7 @@ class VarianceBinarizer(BaseBinarizer):
                         align_length=length
                     )
             if energy is None:
-                energy = get_energy_librosa(waveform, length, hparams).astype(np.float32)
+                energy = get_energy_librosa(waveform, length, hparams, cache=self.feature_cache).astype(np.float32)
                 energy_from_wav = True
 
             if energy_from_wav:
@@ -320,7 +378,10 @@ class VarianceBinarizer(BaseBinarizer):
                         align_length=length
                     )
             if breathiness is None:
-                breathiness = get_breathiness_pyworld(waveform, f0 * ~uv, length, hparams).astype(np.float32)
+                breathiness = get_breathiness_pyworld(
+                    waveform, f0 * ~uv, length, hparams,
+                    approximate=self.approximate_breathiness, cache=self.feature_cache
+                ).astype(np.float32)
                 breathiness_from_wav = True
 
             if breathiness_from_wav:
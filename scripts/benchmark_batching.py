@@ -0,0 +1,105 @@
+import argparse
+import pathlib
+import sys
+import time
+
+import numpy as np
+
+root_dir = pathlib.Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(root_dir))
+
+from utils import batch_by_size
+
+
+def batch_by_size_legacy(
+        indices, num_frames_fn, max_batch_frames=80000, max_batch_size=48,
+        required_batch_size_multiple=1
+):
+    """
+    The previous per-item implementation of utils.batch_by_size, kept here as the baseline.
+    """
+    bsz_mult = required_batch_size_multiple
+
+    sample_len = 0
+    sample_lens = []
+    batch = []
+    batches = []
+    for i in range(len(indices)):
+        idx = indices[i]
+        num_frames = num_frames_fn(idx)
+        sample_lens.append(num_frames)
+        sample_len = max(sample_len, num_frames)
+        assert sample_len <= max_batch_frames
+        num_frames = (len(batch) + 1) * sample_len
+
+        if len(batch) > 0 and (len(batch) == max_batch_size or num_frames > max_batch_frames):
+            mod_len = max(
+                bsz_mult * (len(batch) // bsz_mult),
+                len(batch) % bsz_mult,
+            )
+            batches.append(batch[:mod_len])
+            batch = batch[mod_len:]
+            sample_lens = sample_lens[mod_len:]
+            sample_len = max(sample_lens) if len(sample_lens) > 0 else 0
+        batch.append(idx)
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+
+def synthesize_sizes(distribution, num_items, rng):
+    if distribution == 'uniform':
+        sizes = rng.uniform(100, 2000, num_items)
+    elif distribution == 'lognormal':
+        # typical lengths of sliced singing segments: mostly a few seconds with a long tail
+        sizes = rng.lognormal(mean=np.log(600), sigma=0.5, size=num_items)
+    elif distribution == 'bimodal':
+        sizes = np.where(rng.random(num_items) < 0.7, rng.normal(400, 80, num_items), rng.normal(1800, 300, num_items))
+    else:
+        raise ValueError(f'Unknown distribution: {distribution}')
+    return sizes.clip(10, 3000).astype(np.int64)
+
+
+def benchmark(fn, repeats):
+    best = float('inf')
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare batch_by_size with the previous implementation.')
+    parser.add_argument('--num_items', type=int, default=500000, help='Number of items in the synthetic dataset.')
+    parser.add_argument('--max_batch_frames', type=int, default=50000)
+    parser.add_argument('--max_batch_size', type=int, default=64)
+    parser.add_argument('--repeats', type=int, default=3, help='Best of this number of runs is reported.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    for distribution in ['uniform', 'lognormal', 'bimodal']:
+        sizes = synthesize_sizes(distribution, args.num_items, rng)
+        # shuffled and then sorted by size on a grid, like DsBatchSampler does
+        indices = rng.permutation(args.num_items)
+        indices = indices[np.argsort((sizes[indices] / 200).round(), kind='mergesort')]
+        kwargs = {'max_batch_frames': args.max_batch_frames, 'max_batch_size': args.max_batch_size}
+
+        legacy_time, legacy_batches = benchmark(
+            lambda: batch_by_size_legacy(indices.tolist(), lambda i: sizes[i], **kwargs), args.repeats
+        )
+        new_time, new_batches = benchmark(lambda: batch_by_size(indices, sizes, **kwargs), args.repeats)
+        assert len(legacy_batches) == len(new_batches) and all(
+            a == b.tolist() for a, b in zip(legacy_batches, new_batches)
+        ), 'Batches are different from the previous implementation.'
+        print(
+            f'{distribution:>10}: {len(new_batches)} batches, '
+            f'legacy {legacy_time * 1000:.1f} ms, vectorized {new_time * 1000:.1f} ms '
+            f'({legacy_time / new_time:.1f}x)'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+import argparse
 import importlib
 import os
 import sys
@@ -13,12 +14,30 @@ set_hparams()
 
 
 def binarize():
+    parser = argparse.ArgumentParser(description='Binarize the dataset.')
+    parser.add_argument(
+        '--shard', type=str, default=None, metavar='INDEX/COUNT',
+        help='Process only one of COUNT disjoint shards of the items, e.g. 0/8. '
+             'Shards can be processed on different machines and combined by --merge.'
+    )
+    parser.add_argument(
+        '--merge', type=int, default=None, metavar='COUNT',
+        help='Merge COUNT shards in the binary data directory into the final binary data.'
+    )
+    args, _ = parser.parse_known_args()
     binarizer_cls = hparams.get("binarizer_cls", 'basics.base_binarizer.BaseBinarizer')
     pkg = ".".join(binarizer_cls.split(".")[:-1])
     cls_name = binarizer_cls.split(".")[-1]
     binarizer_cls = getattr(importlib.import_module(pkg), cls_name)
     print("| Binarizer: ", binarizer_cls)
-    binarizer_cls().process()
+    binarizer = binarizer_cls()
+    if args.merge is not None:
+        binarizer.merge_shards(args.merge)
+    elif args.shard is not None:
+        index, count = args.shard.split('/')
+        binarizer.process(shard=(int(index), int(count)))
+    else:
+        binarizer.process()
 
 
 if __name__ == '__main__':
@@ -1,8 +1,12 @@
 import pathlib
+import sys
 from collections import OrderedDict
 
 import click
 
+root_dir = pathlib.Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(root_dir))
+
 
 @click.group()
 def main():
@@ -74,5 +78,26 @@ def txt(
         writer.writerows(utterances)
 
 
+@main.command(help='Convert binary data files to another storage format')
+@click.argument('binary_data_dir', metavar='BINARY_DATA_DIR')
+@click.option('--format', 'dataset_format', type=click.Choice(['hdf5', 'mmap']), required=True,
+              help='Target storage format')
+def data(
+        binary_data_dir: str,
+        dataset_format: str
+):
+    binary_data_dir = pathlib.Path(binary_data_dir).resolve()
+    assert binary_data_dir.exists(), 'The binary data directory does not exist.'
+
+    from utils.indexed_datasets import convert_indexed_dataset
+    prefixes = sorted(p.name[:-len('.data')] for p in binary_data_dir.glob('*.data'))
+    assert len(prefixes) > 0, 'No binary data files found.'
+    for prefix in prefixes:
+        if convert_indexed_dataset(binary_data_dir, prefix, dataset_format):
+            print(f'| {prefix}: converted to {dataset_format}.')
+        else:
+            print(f'| {prefix}: already in {dataset_format} format.')
+
+
 if __name__ == '__main__':
     main()
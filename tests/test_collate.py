@@ -0,0 +1,23 @@
+import torch
+
+from utils import collate_fields, collate_nd
+
+
+def test_collate_fields_matches_collate_nd():
+    mel = [torch.randn(n, 4) for n in (3, 7, 5)]
+    f0 = [torch.randn(n) for n in (3, 7, 5)]
+    tokens = [torch.randint(1, 10, (n,)) for n in (2, 4, 1)]
+    results = collate_fields({
+        'mel': (mel, 0.),
+        'f0': (f0, -1.),
+        'tokens': (tokens, 0),
+    })
+    assert torch.equal(results['mel'], collate_nd(mel, 0.))
+    assert torch.equal(results['f0'], collate_nd(f0, -1.))
+    assert torch.equal(results['tokens'], collate_nd(tokens, 0))
+
+
+def test_collate_nd_max_len():
+    values = [torch.ones(2, dtype=torch.long), torch.ones(3, dtype=torch.long)]
+    res = collate_nd(values, pad_value=-1, max_len=5)
+    assert res.tolist() == [[1, 1, -1, -1, -1], [1, 1, 1, -1, -1]]
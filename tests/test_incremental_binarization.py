@@ -0,0 +1,90 @@
+import csv
+import json
+import pathlib
+import re
+import subprocess
+import sys
+
+import numpy as np
+import soundfile as sf
+
+ROOT_DIR = pathlib.Path(__file__).parent.parent.resolve()
+SAMPLE_RATE = 44100
+
+
+def write_raw_data(raw_dir: pathlib.Path, num_items):
+    rng = np.random.default_rng(0)
+    (raw_dir / 'wavs').mkdir(parents=True, exist_ok=True)
+    rows = []
+    for i in range(num_items):
+        dur = rng.uniform(1.0, 2.0)
+        t = np.arange(int(dur * SAMPLE_RATE)) / SAMPLE_RATE
+        f = 220 * 2 ** (rng.integers(-5, 6) / 12)
+        y = 0.3 * np.sin(2 * np.pi * f * t) + 0.01 * rng.standard_normal(len(t))
+        sf.write(raw_dir / 'wavs' / f'{i:04d}.wav', y.astype(np.float32), SAMPLE_RATE)
+        rows.append({
+            'name': f'{i:04d}',
+            'ph_seq': 'SP a b AP',
+            'ph_dur': ' '.join([f'{dur / 4:.6f}'] * 4)
+        })
+    return rows
+
+
+def write_transcriptions(raw_dir: pathlib.Path, rows):
+    with open(raw_dir / 'transcriptions.csv', 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['name', 'ph_seq', 'ph_dur'])
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def binarize(config_path: pathlib.Path):
+    result = subprocess.run(
+        [sys.executable, 'scripts/binarize.py', '--config', str(config_path)],
+        cwd=ROOT_DIR, capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    return result.stdout
+
+
+def test_augmented_items_are_reused_after_adding_items(tmp_path):
+    raw_dir = tmp_path / 'raw'
+    binary_dir = tmp_path / 'binary'
+    rows = write_raw_data(raw_dir, num_items=10)
+    (tmp_path / 'dict.txt').write_text('a\ta\nb\tb\n', encoding='utf-8')
+    config_path = tmp_path / 'config.yaml'
+    config_path.write_text(json.dumps({
+        'base_config': [str(ROOT_DIR / 'configs' / 'acoustic.yaml')],
+        'raw_data_dir': str(raw_dir),
+        'binary_data_dir': str(binary_dir),
+        'dictionary': str(tmp_path / 'dict.txt'),
+        'test_prefixes': ['0000'],
+        'pe': 'parselmouth',
+        'binarization_args': {'num_workers': 0, 'incremental': True},
+        'augmentation_args': {
+            'random_pitch_shifting': {'enabled': True, 'scale': 1.0},
+            'random_time_stretching': {'enabled': True, 'scale': 1.0}
+        },
+        'use_key_shift_embed': True,
+        'use_speed_embed': True
+    }), encoding='utf-8')
+
+    write_transcriptions(raw_dir, rows[:8])
+    binarize(config_path)
+    with open(binary_dir / 'train.manifest.json', 'r', encoding='utf-8') as f:
+        previous = json.load(f)['items']
+
+    write_transcriptions(raw_dir, rows)
+    log = binarize(config_path)
+    with open(binary_dir / 'train.manifest.json', 'r', encoding='utf-8') as f:
+        current = json.load(f)['items']
+
+    augmented = [name for name, entry in previous.items() if len(entry.get('augmentation', [])) > 0]
+    assert len(augmented) > 0
+    num_reused, num_reused_aug = map(int, re.search(
+        r'train: (\d+) items are unchanged and will be reused \((\d+) of them together', log
+    ).groups())
+    assert num_reused == len(previous)
+    assert num_reused_aug == len(augmented)
+    for name in previous:
+        assert current[name].get('augmentation') == previous[name].get('augmentation')
+        assert current[name]['count'] == previous[name]['count']
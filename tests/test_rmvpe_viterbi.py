@@ -0,0 +1,76 @@
+import librosa
+import numpy as np
+import torch
+
+import modules.pe.rmvpe.utils as rmvpe_utils
+from modules.pe.rmvpe.constants import N_CLASS
+
+
+def librosa_viterbi_path(hidden):
+    xx, yy = np.meshgrid(range(N_CLASS), range(N_CLASS))
+    transition = np.maximum(30 - abs(xx - yy), 0)
+    transition = transition / transition.sum(axis=1, keepdims=True)
+    prob = hidden.squeeze(0).numpy().T
+    prob = prob / prob.sum(axis=0)
+    return librosa.sequence.viterbi(prob, transition).astype(np.int64)
+
+
+def viterbi_path(hidden):
+    # capture the decoded states passed to to_local_average_f0
+    captured = {}
+    original = rmvpe_utils.to_local_average_f0
+
+    def capture(hidden_, center=None, thred=0.03):
+        captured['center'] = center
+        return original(hidden_, center=center, thred=thred)
+
+    rmvpe_utils.to_local_average_f0 = capture
+    try:
+        f0 = rmvpe_utils.to_viterbi_f0(hidden)
+    finally:
+        rmvpe_utils.to_local_average_f0 = original
+    return captured['center'][..., 0].numpy(), f0
+
+
+def synthetic_activations(n_frames, peaks, seed, noise=0.02):
+    rng = np.random.default_rng(seed)
+    hidden = rng.uniform(0, noise, (1, n_frames, N_CLASS)).astype(np.float32)
+    bins = np.arange(N_CLASS)
+    for t, peak in enumerate(peaks):
+        hidden[0, t] += np.exp(-0.5 * ((bins - peak) / 2) ** 2)
+    return torch.from_numpy(hidden.clip(0, 1))
+
+
+def test_matches_librosa_on_smooth_contour():
+    peaks = 180 + 40 * np.sin(np.linspace(0, 6, 200))
+    hidden = synthetic_activations(200, peaks, seed=0)
+    path, _ = viterbi_path(hidden)
+    assert np.array_equal(path[0], librosa_viterbi_path(hidden))
+
+
+def test_matches_librosa_on_large_pitch_leaps():
+    # leaps of 270 and 150 bins (far beyond the transition band) with confident activations
+    peaks = [50] * 40 + [320] * 30 + [170] * 30
+    hidden = synthetic_activations(100, peaks, seed=1, noise=1e-9)
+    path, _ = viterbi_path(hidden)
+    expected = librosa_viterbi_path(hidden)
+    assert np.array_equal(path[0], expected)
+    assert expected[40] == 320 and expected[70] == 170
+
+
+def test_matches_librosa_on_noise():
+    for seed in range(3):
+        hidden = torch.from_numpy(np.random.default_rng(seed).uniform(0, 1, (1, 50, N_CLASS)).astype(np.float32))
+        path, _ = viterbi_path(hidden)
+        assert np.array_equal(path[0], librosa_viterbi_path(hidden))
+
+
+def test_batched_decoding_matches_single():
+    hiddens = [
+        synthetic_activations(80, [60] * 30 + [300] * 50, seed=2),
+        synthetic_activations(80, 200 + 30 * np.cos(np.linspace(0, 4, 80)), seed=3),
+    ]
+    batched, _ = viterbi_path(torch.cat(hiddens, dim=0))
+    for i, hidden in enumerate(hiddens):
+        single, _ = viterbi_path(hidden)
+        assert np.array_equal(batched[i], single[0])
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from utils.training_utils import DsBatchSampler, DsEvalBatchSampler
+
+
+class FakeDataset:
+    def __init__(self, sizes):
+        self._sizes = np.asarray(sizes)
+
+    def __len__(self):
+        return len(self._sizes)
+
+
+def test_padding_ratio_of_empty_replica():
+    sampler = DsBatchSampler(
+        FakeDataset([100, 200, 300]), max_batch_frames=1000, max_batch_size=4,
+        sub_indices=[], num_replicas=1, rank=0
+    )
+    assert len(sampler) == 0
+    assert sampler.padding_ratio == 0.
+
+
+def test_padding_ratio():
+    sampler = DsBatchSampler(
+        FakeDataset([100, 300, 200, 400]), max_batch_frames=800, max_batch_size=2,
+        num_replicas=1, rank=0
+    )
+    # batches: [0, 1] padded to 300 frames, [2, 3] padded to 400 frames
+    assert [list(batch) for batch in sampler] == [[0, 1], [2, 3]]
+    assert np.isclose(sampler.padding_ratio, 1 - 1000 / 1400)
+
+
+def eval_samplers(sizes, num_replicas, num_leading_items, batch_by_size):
+    dataset = FakeDataset(sizes)
+    return [
+        DsEvalBatchSampler(
+            dataset, max_batch_frames=2000, max_batch_size=8,
+            num_replicas=num_replicas, rank=rank,
+            batch_by_size=batch_by_size, num_leading_items=num_leading_items
+        )
+        for rank in range(num_replicas)
+    ]
+
+
+@pytest.mark.parametrize('num_items,num_replicas,num_leading_items,batch_by_size', [
+    (1, 1, 10, True),
+    (8, 8, 10, True),
+    (3, 8, 0, True),
+    (20, 4, 0, False),
+    (500, 8, 10, True),
+    (500, 3, 600, True),
+])
+def test_eval_items_are_weighted_once_across_ranks(num_items, num_replicas, num_leading_items, batch_by_size):
+    sizes = np.random.default_rng(0).integers(50, 1000, num_items)
+    samplers = eval_samplers(sizes, num_replicas, num_leading_items, batch_by_size)
+    weighted, plotted = [], []
+    for rank, sampler in enumerate(samplers):
+        assert len(sampler) > 0
+        assert len(sampler.batches) == len(sampler.weighted) == len(sampler.plotted)
+        for batch, is_weighted, is_plotted in zip(sampler.batches, sampler.weighted, sampler.plotted):
+            if is_weighted:
+                weighted.extend(batch)
+            if is_plotted:
+                assert rank == 0
+                plotted.extend(batch)
+    assert sorted(weighted) == list(range(num_items))
+    assert plotted == list(range(min(num_leading_items, num_items)))
@@ -30,22 +30,27 @@ class AcousticDataset(BaseDataset):
         self.need_key_shift = hparams.get('use_key_shift_embed', False)
         self.need_speed = hparams.get('use_speed_embed', False)
         self.need_spk_id = hparams['use_spk_id']
+        self.mel_storage = self.indexed_ds.metadata.get('mel_storage', 'float32')
 
     def collater(self, samples):
         batch = super().collater(samples)
 
-        tokens = utils.collate_nd([s['tokens'] for s in samples], 0)
-        f0 = utils.collate_nd([s['f0'] for s in samples], 0.0)
-        mel2ph = utils.collate_nd([s['mel2ph'] for s in samples], 0)
-        mel = utils.collate_nd([s['mel'] for s in samples], 0.0)
-        batch.update({
-            'tokens': tokens,
-            'mel2ph': mel2ph,
-            'mel': mel,
-            'f0': f0,
-        })
+        if self.mel_storage == 'uint8':
+            mels = [
+                s['mel'].float() * ((s['mel_range'][1] - s['mel_range'][0]) / 255) + s['mel_range'][0]
+                for s in samples
+            ]
+        else:
+            mels = [s['mel'].float() for s in samples]
+        fields = {
+            'tokens': ([s['tokens'] for s in samples], 0),
+            'mel2ph': ([s['mel2ph'] for s in samples], 0),
+            'mel': (mels, 0.0),
+            'f0': ([s['f0'] for s in samples], 0.0),
+        }
         for v_name, v_pad in self.required_variances.items():
-            batch[v_name] = utils.collate_nd([s[v_name] for s in samples], v_pad)
+            fields[v_name] = ([s[v_name] for s in samples], v_pad)
+        batch.update(utils.collate_fields(fields))
         if self.need_key_shift:
             batch['key_shift'] = torch.FloatTensor([s['key_shift'] for s in samples])[:, None]
         if self.need_speed:
@@ -124,13 +129,17 @@ class AcousticTask(BaseTask):
     def _validation_step(self, sample, batch_idx):
         losses = self.run_model(sample, infer=False)
 
-        if batch_idx < hparams['num_valid_plots'] \
-                and (self.trainer.distributed_sampler_kwargs or {}).get('rank', 0) == 0:
+        # items to plot are batched on their own and iterated on rank 0 by the validation sampler
+        if self.validation_sampler.plotted[batch_idx]:
             mel_pred = self.run_model(sample, infer=True)
 
-            if self.use_vocoder:
-                self.plot_wav(batch_idx, sample['mel'], mel_pred, f0=sample['f0'])
-            self.plot_mel(batch_idx, sample['mel'], mel_pred, name=f'diffmel_{batch_idx}')
+            for i, idx in enumerate(sample['indices'].tolist()):
+                length = (sample['mel2ph'][i] > 0).sum().item()
+                gt_mel = sample['mel'][i: i + 1, :length]
+                pred_mel = mel_pred[i: i + 1, :length]
+                if self.use_vocoder:
+                    self.plot_wav(idx, gt_mel, pred_mel, f0=sample['f0'][i: i + 1, :length])
+                self.plot_mel(idx, gt_mel, pred_mel, name=f'diffmel_{idx}')
 
         return losses, sample['size']
 
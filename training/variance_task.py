@@ -29,28 +29,26 @@ class VarianceDataset(BaseDataset):
     def collater(self, samples):
         batch = super().collater(samples)
 
-        tokens = utils.collate_nd([s['tokens'] for s in samples], 0)
-        ph_dur = utils.collate_nd([s['ph_dur'] for s in samples], 0)
-        batch.update({
-            'tokens': tokens,
-            'ph_dur': ph_dur
-        })
-
+        fields = {
+            'tokens': ([s['tokens'] for s in samples], 0),
+            'ph_dur': ([s['ph_dur'] for s in samples], 0),
+        }
         if hparams['use_spk_id']:
             batch['spk_ids'] = torch.LongTensor([s['spk_id'] for s in samples])
         if hparams['predict_dur']:
-            batch['ph2word'] = utils.collate_nd([s['ph2word'] for s in samples], 0)
-            batch['midi'] = utils.collate_nd([s['midi'] for s in samples], 0)
+            fields['ph2word'] = ([s['ph2word'] for s in samples], 0)
+            fields['midi'] = ([s['midi'] for s in samples], 0)
         if hparams['predict_pitch']:
-            batch['base_pitch'] = utils.collate_nd([s['base_pitch'] for s in samples], 0)
+            fields['base_pitch'] = ([s['base_pitch'] for s in samples], 0)
         if hparams['predict_pitch'] or self.predict_variances:
-            batch['mel2ph'] = utils.collate_nd([s['mel2ph'] for s in samples], 0)
-            batch['pitch'] = utils.collate_nd([s['pitch'] for s in samples], 0)
-            batch['uv'] = utils.collate_nd([s['uv'] for s in samples], True)
+            fields['mel2ph'] = ([s['mel2ph'] for s in samples], 0)
+            fields['pitch'] = ([s['pitch'] for s in samples], 0)
+            fields['uv'] = ([s['uv'] for s in samples], True)
         if hparams['predict_energy']:
-            batch['energy'] = utils.collate_nd([s['energy'] for s in samples], 0)
+            fields['energy'] = ([s['energy'] for s in samples], 0)
         if hparams['predict_breathiness']:
-            batch['breathiness'] = utils.collate_nd([s['breathiness'] for s in samples], 0)
+            fields['breathiness'] = ([s['breathiness'] for s in samples], 0)
+        batch.update(utils.collate_fields(fields))
 
         return batch
 
@@ -177,9 +175,10 @@ class VarianceTask(BaseTask):
     def _validation_step(self, sample, batch_idx):
         losses = self.run_model(sample, infer=False)
 
-        if batch_idx < hparams['num_valid_plots'] \
-                and (self.trainer.distributed_sampler_kwargs or {}).get('rank', 0) == 0:
+        # items to plot are batched on their own and iterated on rank 0 by the validation sampler
+        if self.validation_sampler.plotted[batch_idx]:
             dur_pred, pitch_pred, variances_pred = self.run_model(sample, infer=True)
+            indices = sample['indices'].tolist()
             if dur_pred is not None:
                 tokens = sample['tokens']
                 dur_gt = sample['ph_dur']
@@ -191,30 +190,41 @@ class VarianceTask(BaseTask):
                 self.ph_dur_acc.update(
                     pdur_pred=dur_pred, pdur_target=dur_gt, ph2word=ph2word, mask=mask
                 )
-                self.plot_dur(batch_idx, dur_gt, dur_pred, txt=tokens)
+                for i, idx in enumerate(indices):
+                    length = mask[i].sum().item()
+                    self.plot_dur(
+                        idx, dur_gt[i: i + 1, :length], dur_pred[i: i + 1, :length],
+                        txt=tokens[i: i + 1, :length]
+                    )
+            if pitch_pred is not None or len(self.variance_prediction_list) > 0:
+                frame_lengths = (sample['mel2ph'] > 0).sum(dim=1).tolist()
             if pitch_pred is not None:
                 base_pitch = sample['base_pitch']
                 pred_pitch = base_pitch + pitch_pred
                 gt_pitch = sample['pitch']
                 mask = (sample['mel2ph'] > 0) & ~sample['uv']
                 self.pitch_acc.update(pred=pred_pitch, target=gt_pitch, mask=mask)
-                self.plot_curve(
-                    batch_idx,
-                    gt_curve=gt_pitch,
-                    pred_curve=pred_pitch,
-                    base_curve=base_pitch,
-                    curve_name='pitch',
-                    grid=1
-                )
+                for i, idx in enumerate(indices):
+                    length = frame_lengths[i]
+                    self.plot_curve(
+                        idx,
+                        gt_curve=gt_pitch[i: i + 1, :length],
+                        pred_curve=pred_pitch[i: i + 1, :length],
+                        base_curve=base_pitch[i: i + 1, :length],
+                        curve_name='pitch',
+                        grid=1
+                    )
             for name in self.variance_prediction_list:
                 variance = sample[name]
                 variance_pred = variances_pred[name]
-                self.plot_curve(
-                    batch_idx,
-                    gt_curve=variance,
-                    pred_curve=variance_pred,
-                    curve_name=name
-                )
+                for i, idx in enumerate(indices):
+                    length = frame_lengths[i]
+                    self.plot_curve(
+                        idx,
+                        gt_curve=variance[i: i + 1, :length],
+                        pred_curve=variance_pred[i: i + 1, :length],
+                        curve_name=name
+                    )
 
         return losses, sample['size']
 
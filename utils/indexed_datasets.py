@@ -1,21 +1,166 @@
-import pathlib
+import json
 import multiprocessing
-from collections import deque
+import pathlib
+import queue
+import shutil
+import threading
+import time
+from collections import OrderedDict
 
 import h5py
 import torch
 import numpy as np
 
 
+class MemmapDataset:
+    """
+    Read-only access to a dataset stored in the 'mmap' format, which is a directory containing:
+        meta.json: number of items, and dtype and trailing shape of each attribute;
+        <attr>.bin: all values of the attribute concatenated along the first axis;
+        <attr>.idx.npy: int64[N, 2], start and end row of each item, or -1 if the item lacks the attribute.
+    Arrays returned by this class are copy-on-write views of the memory-mapped files.
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        with open(self.path / 'meta.json', 'r', encoding='utf8') as f:
+            meta = json.load(f)
+        self.num_items = meta['num_items']
+        self.attrs = meta['attrs']
+        self.metadata = meta.get('metadata', {})
+        self.offsets = {}
+        self.arrays = {}
+        for k, attr in self.attrs.items():
+            self.offsets[k] = np.load(self.path / f'{k}.idx.npy')
+            num_rows = int(self.offsets[k][:, 1].max(initial=0))
+            shape = (num_rows, *attr['shape'])
+            if num_rows == 0:
+                self.arrays[k] = np.empty(shape, dtype=attr['dtype'])
+            else:
+                self.arrays[k] = np.memmap(self.path / f'{k}.bin', dtype=attr['dtype'], mode='c', shape=shape)
+
+    def __getitem__(self, i):
+        item = {}
+        for k, attr in self.attrs.items():
+            start, end = self.offsets[k][i]
+            if start < 0:
+                continue
+            item[k] = self.arrays[k][start] if attr['scalar'] else self.arrays[k][start:end]
+        return item
+
+    def __len__(self):
+        return self.num_items
+
+    def close(self):
+        self.arrays.clear()
+
+
+class _Hdf5Reader:
+    def __init__(self, dset: h5py.File):
+        self.dset = dset
+
+    def __getitem__(self, i):
+        return {k: v[()] for k, v in self.dset[str(i)].items()}
+
+    def __len__(self):
+        return len(self.dset)
+
+
+class SharedMemoryDataset:
+    """
+    All items of a dataset loaded into torch shared memory, using the same layout as MemmapDataset.
+    Forked or spawned subprocesses (e.g. dataloader workers) read the same copy of the data.
+    """
+
+    def __init__(self, reader):
+        self.num_items = len(reader)
+        values = {}
+        for i in range(self.num_items):
+            for k, v in reader[i].items():
+                values.setdefault(k, []).append((i, np.asarray(v)))
+        self.scalar = {}
+        self.offsets = {}
+        self.tensors = {}
+        for k, vs in values.items():
+            self.scalar[k] = vs[0][1].ndim == 0
+            offsets = np.full((self.num_items, 2), -1, dtype=np.int64)
+            start = 0
+            for i, v in vs:
+                end = start + (1 if self.scalar[k] else v.shape[0])
+                offsets[i] = start, end
+                start = end
+            self.offsets[k] = offsets
+            self.tensors[k] = torch.from_numpy(
+                np.stack([v for _, v in vs]) if self.scalar[k] else np.concatenate([v for _, v in vs])
+            ).share_memory_()
+        values.clear()
+
+    def __getitem__(self, i):
+        item = {}
+        for k, tensor in self.tensors.items():
+            start, end = self.offsets[k][i]
+            if start < 0:
+                continue
+            item[k] = tensor[start] if self.scalar[k] else tensor[start:end]
+        return item
+
+    def __len__(self):
+        return self.num_items
+
+    def close(self):
+        self.tensors.clear()
+
+
 class IndexedDataset:
-    def __init__(self, path, prefix, num_cache=0):
+    """
+    Random access to items written by IndexedDatasetBuilder.
+    The storage format (a single HDF5 file or an 'mmap' directory) is detected from the path.
+
+    Dataset-level information saved by the builder is available in the metadata dict.
+
+    Small datasets can be loaded entirely into shared memory by preload(), so that the subprocesses
+    created afterwards (e.g. dataloader workers) do not read the file again.
+
+    Loaded items can be kept in an LRU cache whose total tensor size is limited to cache_bytes
+    (0 disables the cache). The cache lives in the current process, i.e. each dataloader worker
+    has its own one. Cached tensors are shared with the caller and must not be modified in place.
+    """
+
+    def __init__(self, path, prefix, cache_bytes=0):
         super().__init__()
         self.path = pathlib.Path(path) / f'{prefix}.data'
         if not self.path.exists():
             raise FileNotFoundError(f'IndexedDataset not found: {self.path}')
+        self.backend = 'mmap' if self.path.is_dir() else 'hdf5'
         self.dset = None
-        self.cache = deque(maxlen=num_cache)
-        self.num_cache = num_cache
+        if self.backend == 'mmap':
+            with open(self.path / 'meta.json', 'r', encoding='utf8') as f:
+                self.metadata = json.load(f).get('metadata', {})
+        else:
+            with h5py.File(self.path, 'r') as f:
+                self.metadata = json.loads(f.attrs.get('metadata', '{}'))
+        self.cache = OrderedDict()
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def open(self):
+        if self.backend == 'mmap':
+            self.dset = MemmapDataset(self.path)
+        else:
+            self.dset = h5py.File(self.path, 'r')
+
+    def preload(self):
+        if self.dset is None:
+            self.open()
+        if self.backend == 'memory':
+            return
+        reader = self.dset if self.backend == 'mmap' else _Hdf5Reader(self.dset)
+        preloaded = SharedMemoryDataset(reader)
+        self.dset.close()
+        self.dset = preloaded
+        self.backend = 'memory'
 
     def check_index(self, i):
         if i < 0 or i >= len(self.dset):
@@ -25,29 +170,74 @@ class IndexedDataset:
         if self.dset:
             self.dset.close()
 
+    def read_item(self, i):
+        if self.backend == 'hdf5':
+            return _Hdf5Reader(self.dset)[i]
+        return self.dset[i]
+
     def __getitem__(self, i):
         if self.dset is None:
-            self.dset = h5py.File(self.path, 'r')
+            self.open()
         self.check_index(i)
-        if self.num_cache > 0:
-            for c in self.cache:
-                if c[0] == i:
-                    return c[1]
-        item = {k: v[()].item() if v.shape == () else torch.from_numpy(v[()]) for k, v in self.dset[str(i)].items()}
-        if self.num_cache > 0:
-            self.cache.appendleft((i, item))
+        if self.cache_bytes > 0:
+            if i in self.cache:
+                self.cache_hits += 1
+                self.cache.move_to_end(i)
+                return self.cache[i][0]
+            self.cache_misses += 1
+        item = {
+            k: v.item() if np.ndim(v) == 0 else torch.as_tensor(v)
+            for k, v in self.read_item(i).items()
+        }
+        if self.cache_bytes > 0:
+            self.cache_item(i, item)
         return item
 
+    def cache_item(self, i, item):
+        size = sum(v.element_size() * v.numel() for v in item.values() if isinstance(v, torch.Tensor))
+        if size > self.cache_bytes:
+            return
+        while self.cached_bytes + size > self.cache_bytes:
+            _, (_, evicted_size) = self.cache.popitem(last=False)
+            self.cached_bytes -= evicted_size
+        self.cache[i] = (item, size)
+        self.cached_bytes += size
+
     def __len__(self):
         if self.dset is None:
-            self.dset = h5py.File(self.path, 'r')
+            self.open()
         return len(self.dset)
 
 
 class IndexedDatasetBuilder:
-    def __init__(self, path, prefix, allowed_attr=None):
+    """
+    Write items into an indexed dataset. Available backends:
+        hdf5: one HDF5 group per item and one HDF5 dataset per attribute;
+        mmap: one flat file per attribute with an offsets index, read through np.memmap (see MemmapDataset).
+    metadata is a JSON-serializable dict describing the whole dataset, saved along with the items.
+    compression maps attribute names to HDF5 filters ('lzf', 'gzip' or 'gzip:<level>'); hdf5 backend only.
+    If queue_size > 0, items are written by a background thread so that the caller does not wait for the
+    disk; add_item() blocks only when queue_size items are pending.
+    """
+
+    def __init__(self, path, prefix, allowed_attr=None, backend='hdf5', metadata=None,
+                 compression=None, queue_size=0):
+        assert backend in ['hdf5', 'mmap'], f'Unknown indexed dataset backend: {backend}'
         self.path = pathlib.Path(path) / f'{prefix}.data'
         self.prefix = prefix
+        self.backend = backend
+        self.metadata = metadata if metadata is not None else {}
+        self.compression = {}
+        if compression:
+            if backend != 'hdf5':
+                raise ValueError(f'Compression is not supported by the \'{backend}\' backend.')
+            for k, c in compression.items():
+                if c is None:
+                    continue
+                name, _, level = str(c).partition(':')
+                if name not in ['gzip', 'lzf']:
+                    raise ValueError(f'Unknown compression filter \'{c}\' of attribute \'{k}\'.')
+                self.compression[k] = (name, int(level) if level else None)
         self.dset = None
         self.counter = 0
         self.lock = multiprocessing.Lock()
@@ -55,10 +245,39 @@ class IndexedDatasetBuilder:
             self.allowed_attr = set(allowed_attr)
         else:
             self.allowed_attr = None
+        # states of the mmap backend
+        self.attrs = {}
+        self.files = {}
+        self.offsets = {}
+        self.num_rows = {}
+        # states of the background writer
+        self.queue_size = queue_size
+        self.queue = None
+        self.writer = None
+        self.writer_error = None
+        # statistics
+        self.num_bytes = 0
+        self.write_time = 0.
+        self.wait_time = 0.
+
+    def open(self):
+        if self.path.is_dir():
+            shutil.rmtree(self.path)
+        elif self.path.exists():
+            self.path.unlink()
+        if self.backend == 'mmap':
+            self.path.mkdir(parents=True)
+            self.dset = self.path
+        else:
+            self.dset = h5py.File(self.path, 'w')
+        if self.queue_size > 0:
+            self.queue = queue.Queue(maxsize=self.queue_size)
+            self.writer = threading.Thread(target=self._writer_loop, name=f'{self.prefix}-writer', daemon=True)
+            self.writer.start()
 
     def add_item(self, item):
         if self.dset is None:
-            self.dset = h5py.File(self.path, 'w')
+            self.open()
         if self.allowed_attr is not None:
             item = {
                 k: item[k]
@@ -67,14 +286,156 @@ class IndexedDatasetBuilder:
             }
         item_no = self.counter
         self.counter += 1
+        if self.writer is None:
+            self._write_item(item_no, item)
+            return
+        if self.writer_error is not None:
+            raise self.writer_error
+        t0 = time.perf_counter()
+        self.queue.put((item_no, item))
+        self.wait_time += time.perf_counter() - t0
+
+    def _writer_loop(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                return
+            if self.writer_error is not None:
+                # keep consuming so that the producer never blocks on a full queue
+                continue
+            try:
+                self._write_item(*task)
+            except Exception as e:
+                self.writer_error = e
+
+    def _write_item(self, item_no, item):
+        t0 = time.perf_counter()
         for k, v in item.items():
             if v is None:
                 continue
-            self.dset.create_dataset(f'{item_no}/{k}', data=v)
+            if self.backend == 'mmap':
+                self._write_mmap(item_no, k, v)
+            else:
+                self._write_hdf5(item_no, k, v)
+        self.write_time += time.perf_counter() - t0
+
+    def _write_hdf5(self, item_no, k, v):
+        v = np.asarray(v)
+        name, level = self.compression.get(k, (None, None))
+        if v.ndim == 0 or v.size == 0:
+            # scalar and empty datasets cannot be chunked, hence not compressed
+            name = level = None
+        self.dset.create_dataset(f'{item_no}/{k}', data=v, compression=name, compression_opts=level)
+        self.num_bytes += v.nbytes
+
+    def _write_mmap(self, item_no, k, v):
+        v = np.asarray(v)
+        if k not in self.attrs:
+            self.attrs[k] = {'dtype': v.dtype.str, 'shape': list(v.shape[1:]), 'scalar': v.ndim == 0}
+            self.files[k] = open(self.path / f'{k}.bin', 'wb')
+            self.offsets[k] = []
+            self.num_rows[k] = 0
+        attr = self.attrs[k]
+        if (v.ndim == 0) != attr['scalar'] or list(v.shape[1:]) != attr['shape']:
+            raise ValueError(
+                f'Shape {list(v.shape)} of attribute \'{k}\' in item {item_no} '
+                f'is inconsistent with previous items (trailing shape {attr["shape"]}).'
+            )
+        v = np.ascontiguousarray(v, dtype=attr['dtype'])
+        rows = 1 if attr['scalar'] else v.shape[0]
+        self.files[k].write(v.tobytes())
+        self.num_bytes += v.nbytes
+        self.offsets[k].append((item_no, self.num_rows[k], self.num_rows[k] + rows))
+        self.num_rows[k] += rows
+
+    def stop_writer(self):
+        """
+        Wait for all pending items to be written and stop the background writer.
+        """
+        if self.writer is None:
+            return
+        self.queue.put(None)
+        self.writer.join()
+        self.writer = None
+        self.queue = None
+        if self.writer_error is not None:
+            raise self.writer_error
+
+    def report(self):
+        return format_write_report(
+            self.counter, self.num_bytes, self.write_time,
+            wait_time=self.wait_time if self.queue_size > 0 else None
+        )
 
     def finalize(self):
-        if self.dset is not None:
-            self.dset.close()
+        if self.dset is None:
+            return
+        try:
+            self.stop_writer()
+        finally:
+            if self.backend == 'mmap':
+                for k in self.attrs:
+                    self.files[k].close()
+                    offsets = np.full((self.counter, 2), -1, dtype=np.int64)
+                    for item_no, start, end in self.offsets[k]:
+                        offsets[item_no] = start, end
+                    np.save(self.path / f'{k}.idx.npy', offsets)
+                with open(self.path / 'meta.json', 'w', encoding='utf8') as f:
+                    json.dump({'num_items': self.counter, 'attrs': self.attrs, 'metadata': self.metadata}, f)
+                self.files.clear()
+            else:
+                self.dset.attrs['metadata'] = json.dumps(self.metadata)
+                self.dset.close()
+            self.dset = None
+
+
+def format_write_report(num_items, num_bytes, write_time, wait_time=None):
+    mb = num_bytes / 1024 ** 2
+    speed = mb / write_time if write_time > 0 else 0.
+    msg = f'{num_items} items, {mb:.1f} MB written in {write_time:.2f}s ({speed:.1f} MB/s)'
+    if wait_time is not None:
+        msg += f', producer blocked for {wait_time:.2f}s on a full queue'
+    return msg
+
+
+def convert_indexed_dataset(path, prefix, backend):
+    """
+    Convert an existing indexed dataset to another backend in place.
+    """
+    src = IndexedDataset(path, prefix)
+    if src.backend == backend:
+        return False
+    builder = IndexedDatasetBuilder(path, f'{prefix}.tmp', backend=backend, metadata=src.metadata)
+    for i in range(len(src)):
+        builder.add_item(src.read_item(i))
+    builder.finalize()
+    src.dset.close()
+    src.dset = None
+    replace_indexed_dataset(builder.path, src.path)
+    return True
+
+
+def remove_indexed_dataset(path):
+    """
+    Remove an indexed dataset of either format if it exists.
+    """
+    path = pathlib.Path(path)
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+
+
+def replace_indexed_dataset(src, dst):
+    """
+    Move an indexed dataset to dst, replacing the existing one of either format.
+    """
+    src, dst = pathlib.Path(src), pathlib.Path(dst)
+    if dst.is_dir():
+        shutil.rmtree(dst)
+    elif dst.exists() and src.is_dir():
+        dst.unlink()
+    src.replace(dst)
 
 
 if __name__ == "__main__":
@@ -1,8 +1,9 @@
-import platform
 import re
+import signal
+import threading
 import traceback
 
-from torch.multiprocessing import Manager, Process, current_process, get_context
+from torch.multiprocessing import current_process, get_context
 
 is_main_process = not bool(re.match(r'((.*Process)|(SyncManager)|(.*PoolWorker))-\d+', current_process().name))
 
@@ -12,41 +13,64 @@ def main_process_print(self, *args, sep=' ', end='\n', file=None):
         print(self, *args, sep=sep, end=end, file=file)
 
 
-def chunked_worker_run(map_func, args, results_queue=None):
-    for a in args:
-        # noinspection PyBroadException
-        try:
-            res = map_func(*a)
-            results_queue.put(res)
-        except KeyboardInterrupt:
-            break
-        except Exception:
-            traceback.print_exc()
-            results_queue.put(None)
+# The mapping function of the current pool worker, which is sent to each worker only once.
+worker_map_func = None
 
 
-def chunked_multiprocess_run(map_func, args, num_workers, q_max_size=1000):
+def chunked_worker_init(map_func, init_func=None):
+    global worker_map_func
+    # Let the main process handle KeyboardInterrupt and terminate the pool.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_map_func = map_func
+    if init_func is not None:
+        init_func()
+
+
+def chunked_worker_run(a):
+    # noinspection PyBroadException
+    try:
+        return worker_map_func(*a)
+    except Exception:
+        traceback.print_exc()
+        return None
+
+
+def chunked_multiprocess_run(map_func, args, num_workers, q_max_size=1000, init_func=None):
+    """
+    Run map_func(*a) for each a in args in a pool of worker processes and yield the results in the order of args.
+    Workers fetch the next task as soon as they finish one, and results that complete early are held back until
+    the preceding ones are yielded. At most q_max_size tasks are in flight (queued, running or held back).
+    :param map_func: the function to run; it is pickled and sent to each worker once
+    :param args: list of argument tuples
+    :param num_workers: number of worker processes
+    :param q_max_size: maximum number of tasks in flight
+    :param init_func: called once in each worker before running any tasks, e.g. to initialize models
+    """
     num_jobs = len(args)
     if num_jobs < num_workers:
         num_workers = num_jobs
 
-    queues = [Manager().Queue(maxsize=q_max_size // num_workers) for _ in range(num_workers)]
-    if platform.system().lower() != 'windows':
-        process_creation_func = get_context('spawn').Process
-    else:
-        process_creation_func = Process
-
-    workers = []
-    for i in range(num_workers):
-        worker = process_creation_func(
-            target=chunked_worker_run, args=(map_func, args[i::num_workers], queues[i]), daemon=True
-        )
-        workers.append(worker)
-        worker.start()
-
-    for i in range(num_jobs):
-        yield queues[i % num_workers].get()
-
-    for worker in workers:
-        worker.join()
-        worker.close()
+    slots = threading.Semaphore(q_max_size)
+    stopped = False
+
+    def feed_tasks():
+        for a in args:
+            slots.acquire()
+            if stopped:
+                return
+            yield a
+
+    pool = get_context('spawn').Pool(
+        processes=num_workers, initializer=chunked_worker_init, initargs=(map_func, init_func)
+    )
+    try:
+        for res in pool.imap(chunked_worker_run, feed_tasks(), chunksize=1):
+            slots.release()
+            yield res
+        pool.close()
+    finally:
+        # unblock the task feeder before the pool waits for it
+        stopped = True
+        slots.release()
+        pool.terminate()
+        pool.join()
@@ -1,6 +1,5 @@
 import math
 import re
-from copy import deepcopy
 from pathlib import Path
 from typing import Dict
 
@@ -74,7 +73,8 @@ class DsBatchSampler(Sampler):
     def __init__(self, dataset, max_batch_frames, max_batch_size, sub_indices=None,
                  num_replicas=None, rank=None,
                  required_batch_count_multiple=1, batch_by_size=True, sort_by_similar_size=True,
-                 shuffle_sample=False, shuffle_batch=False, seed=0, drop_last=False) -> None:
+                 bucketing='greedy', shuffle_sample=False, shuffle_batch=False, seed=0, drop_last=False) -> None:
+        assert bucketing in ['greedy', 'min_padding'], f'Unknown bucketing method: {bucketing}'
         self.dataset = dataset
         self.max_batch_frames = max_batch_frames
         self.max_batch_size = max_batch_size
@@ -84,6 +84,7 @@ class DsBatchSampler(Sampler):
         self.required_batch_count_multiple = required_batch_count_multiple
         self.batch_by_size = batch_by_size
         self.sort_by_similar_size = sort_by_similar_size
+        self.bucketing = bucketing
         self.shuffle_sample = shuffle_sample
         self.shuffle_batch = shuffle_batch
         self.seed = seed
@@ -91,6 +92,7 @@ class DsBatchSampler(Sampler):
         self.epoch = 0
         self.batches = None
         self.formed = None
+        self._padding_ratio = None
 
     def __form_batches(self):
         if self.formed == self.epoch + self.seed:
@@ -109,14 +111,18 @@ class DsBatchSampler(Sampler):
                 sizes = (np.round(np.array(self.dataset._sizes)[indices] / grid) * grid).clip(grid, None).astype(
                     np.int64)
                 indices = indices[np.argsort(sizes, kind='mergesort')]
-
-            indices = indices.tolist()
         else:
-            indices = self.sub_indices if self.sub_indices is not None else list(range(len(self.dataset)))
+            indices = np.array(self.sub_indices) if self.sub_indices is not None else np.arange(len(self.dataset))
 
-        if self.batch_by_size:
+        if self.batch_by_size and self.bucketing == 'min_padding':
+            batches = utils.batch_by_size_min_padding(
+                indices, self.dataset._sizes,
+                max_batch_frames=self.max_batch_frames,
+                max_batch_size=self.max_batch_size
+            )
+        elif self.batch_by_size:
             batches = utils.batch_by_size(
-                indices, self.dataset.num_frames,
+                indices, self.dataset._sizes,
                 max_batch_frames=self.max_batch_frames,
                 max_batch_size=self.max_batch_size
             )
@@ -148,10 +154,13 @@ class DsBatchSampler(Sampler):
                 batch_assignment.append(
                     batch_assignment[(i + self.epoch * self.required_batch_count_multiple) % floored_batch_count])
 
-        self.batches = [deepcopy(batches[i]) for i in batch_assignment]
+        # batches are read-only index arrays, so repeated ones can be shared
+        self.batches = [batches[i] for i in batch_assignment]
 
         if self.shuffle_batch:
             rng.shuffle(self.batches)
+        self._padding_ratio = None
+        self.formed = self.epoch + self.seed
 
         del indices
         del batches
@@ -159,7 +168,24 @@ class DsBatchSampler(Sampler):
 
     def __iter__(self):
         self.__form_batches()
-        return iter(self.batches)
+        return (batch.tolist() for batch in self.batches)
+
+    @property
+    def padding_ratio(self):
+        """
+        Fraction of padded frames in the batches of this replica in the current epoch.
+        """
+        self.__form_batches()
+        if not self.batches:
+            return 0.
+        if self._padding_ratio is None:
+            sizes = np.asarray(self.dataset._sizes)
+            batch_lens = np.array([len(batch) for batch in self.batches])
+            offsets = np.cumsum(batch_lens) - batch_lens
+            batch_sizes = sizes[np.concatenate(self.batches)]
+            total_frames = (np.maximum.reduceat(batch_sizes, offsets) * batch_lens).sum()
+            self._padding_ratio = 1 - batch_sizes.sum() / total_frames if total_frames > 0 else 0.
+        return float(self._padding_ratio)
 
     def __len__(self):
         self.__form_batches()
@@ -172,30 +198,86 @@ class DsBatchSampler(Sampler):
 
 
 class DsEvalBatchSampler(Sampler):
-    def __init__(self, dataset, max_batch_frames, max_batch_size, rank=None, batch_by_size=True) -> None:
+    """
+    Batch sampler for validation. The first num_leading_items items are batched on their own
+    and in their original order, so that they stay easy to find (e.g. for plotting). The other
+    items are sorted by length (longest first), so that each batch has little padding.
+    With batch_by_size, each batch is limited to max_batch_frames frames (an item longer than
+    that gets a batch of its own); otherwise each batch takes max_batch_size items.
+
+    Batches are partitioned across num_replicas ranks: each batch goes to the rank with the
+    fewest frames assigned so far, and only counts in the validation losses there (see weighted).
+    Rank 0 additionally iterates over all leading batches to plot them (see plotted). Every rank
+    gets at least one batch, because metrics are synchronized across ranks at the end of
+    validation; a rank that has nothing to do gets a filler batch which is neither weighted
+    nor plotted.
+    """
+    def __init__(
+            self, dataset, max_batch_frames, max_batch_size, num_replicas=1, rank=0,
+            batch_by_size=True, num_leading_items=0
+    ) -> None:
         self.dataset = dataset
         self.max_batch_frames = max_batch_frames
         self.max_batch_size = max_batch_size
+        self.num_replicas = num_replicas
         self.rank = rank
         self.batch_by_size = batch_by_size
+        self.num_leading_items = num_leading_items
         self.batches = None
+        self.weighted = None
+        self.plotted = None
         self.batch_size = max_batch_size
         self.drop_last = False
 
-        if self.rank == 0:
-            indices = list(range(len(self.dataset)))
-            if self.batch_by_size:
-                self.batches = utils.batch_by_size(
-                    indices, self.dataset.num_frames,
-                    max_batch_frames=self.max_batch_frames, max_batch_size=self.max_batch_size
-                )
-            else:
-                self.batches = [
-                    indices[i:i + self.max_batch_size]
-                    for i in range(0, len(indices), self.max_batch_size)
-                ]
+        sizes = np.asarray(self.dataset._sizes)
+        num_leading = min(self.num_leading_items, len(sizes))
+        # (batch, is_leading)
+        batches = [
+            (batch, True) for batch in self._make_batches(np.arange(num_leading), sizes)
+        ] + [
+            (batch, False) for batch in self._make_batches(
+                num_leading + np.argsort(-sizes[num_leading:], kind='stable'), sizes
+            )
+        ]
+        # make sure that there are enough batches for all ranks
+        while len(batches) < self.num_replicas and any(len(batch) > 1 for batch, _ in batches):
+            i = max(range(len(batches)), key=lambda j: len(batches[j][0]))
+            batch, is_leading = batches[i]
+            batches[i: i + 1] = [(batch[:len(batch) // 2], is_leading), (batch[len(batch) // 2:], is_leading)]
+
+        def frames(b):
+            return sizes[b].max() * len(b)
+
+        # Rank 0 runs inference on the leading batches, which is counted as one more pass over them.
+        loads = np.zeros(self.num_replicas, dtype=np.int64)
+        loads[0] = sum(frames(batch) for batch, is_leading in batches if is_leading)
+        owners = [0] * len(batches)
+        for i in sorted(range(len(batches)), key=lambda j: -frames(batches[j][0])):
+            owners[i] = int(loads.argmin())
+            loads[owners[i]] += frames(batches[i][0])
+
+        self.batches, self.weighted, self.plotted = [], [], []
+        for (batch, is_leading), owner in zip(batches, owners):
+            plotted = is_leading and self.rank == 0
+            if owner == self.rank or plotted:
+                self.batches.append(batch)
+                self.weighted.append(owner == self.rank)
+                self.plotted.append(plotted)
+        if len(self.batches) == 0:
+            self.batches, self.weighted, self.plotted = [[0]], [False], [False]
+
+    def _make_batches(self, indices, sizes):
+        if self.batch_by_size:
+            batches = utils.batch_by_size(
+                indices, np.minimum(sizes, self.max_batch_frames),
+                max_batch_frames=self.max_batch_frames, max_batch_size=self.max_batch_size
+            )
         else:
-            self.batches = [[0]]
+            batches = [
+                indices[i:i + self.max_batch_size]
+                for i in range(0, len(indices), self.max_batch_size)
+            ]
+        return [batch.tolist() for batch in batches]
 
     def __iter__(self):
         return iter(self.batches)